@@ -0,0 +1,161 @@
+"""Optional ASGI entry point for high-concurrency read traffic
+
+GET /v1/cafes, /v1/locations and /v1/countries are served by async
+handlers on SQLAlchemy's AsyncSession (aiosqlite / asyncpg); every
+other request is passed to the regular Flask app through asgiref.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --workers 4
+"""
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import http_date, parse_etags, parse_date
+
+from main import create_app
+from model import db, Cafe, User, hash_key, get_cafe_serializer, cafe_counts_query, cafes_version_query, normalize_version
+from http_cache import etag_for
+from routes.listing import parse_fields, parse_limit, cafe_page_query, split_page, count_query
+from routes.api_routes import summary_rows
+from ratelimit import rate_limiter, client_identity, forwarded_addr
+from replica import REPLICA_BIND
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(app):
+    """The replica's (or primary's) URL with its asyncio driver
+
+    Taken from the engine Flask-SQLAlchemy built, so a relative SQLite path
+    points at the same file under the instance folder.
+    """
+    with app.app_context():
+        url = db.engines.get(REPLICA_BIND, db.engine).url
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+class AsyncCafeAPI:
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        url = app.config.get('ASYNC_DATABASE_URL') or async_database_url(app)
+        self.engine = create_async_engine(url, pool_pre_ping=True)
+        self.sessions = async_sessionmaker(self.engine)
+        # path -> (Flask endpoint it stands in for, handler)
+        self.routes = {
+            '/v1/cafes': ('api.all_cafes_api', self.all_cafes),
+            '/v1/locations': ('api.all_locations_api', self.all_locations),
+            '/v1/countries': ('api.all_countries_api', self.all_countries),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        route = None
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            route = self.routes.get(scope['path'])
+        args = MultiDict(parse_qsl(scope.get('query_string', b'').decode(), keep_blank_values=True))
+        # Streaming and the unpaginated form stay on the sync app
+        if route is None or args.get('stream') or args.get('all'):
+            return await self.wsgi(scope, receive, send)
+
+        endpoint, handler = route
+        request_headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+        with self.app.app_context():
+            async with self.sessions() as session:
+                allowed, limit_headers = True, {}
+                if rate_limiter.backend:
+                    client = scope.get('client') or (None, None)
+                    key_hash = await self.verified_key_hash(session, request_headers.get('X-API-KEY'))
+                    remote_addr = forwarded_addr(client[0], request_headers.get('X-Forwarded-For'),
+                                                 self.app.config['TRUSTED_PROXY_COUNT'])
+                    allowed, limit_headers = rate_limiter.check(client_identity(key_hash, remote_addr), endpoint)
+                if allowed:
+                    status, body, headers = await self.conditional(session, scope, request_headers, handler, args)
+                else:
+                    status, body = 429, self.app.json.dumps({"error": "Rate limit exceeded"}).encode()
+                    headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]
+        headers += list(limit_headers.items())
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+    async def verified_key_hash(self, session, api_key):
+        """Fingerprint of api_key if it belongs to an active user, else None"""
+        if not api_key:
+            return None
+        key_hash = hash_key(api_key)
+        found = await session.execute(
+            select(User.id).where(User.api_key_hash == key_hash, User.api_key_active.is_(True))
+        )
+        return key_hash if found.first() else None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def conditional(self, session, scope, request_headers, handler, args):
+        """Same ETag / 304 behaviour as http_cache.cached_by_cafes_version"""
+        version, last_modified = normalize_version((await session.execute(cafes_version_query())).first())
+        full_path = f"{scope['path']}?{scope.get('query_string', b'').decode()}"
+        etag = etag_for(version, full_path)
+        headers = [('ETag', f'"{etag}"'), ('Cache-Control', self.app.config['CACHE_CONTROL_API'])]
+        if last_modified:
+            headers.append(('Last-Modified', http_date(last_modified)))
+
+        if_none_match = request_headers.get('If-None-Match')
+        if_modified_since = parse_date(request_headers.get('If-Modified-Since'))
+        if if_none_match:
+            fresh = parse_etags(if_none_match).contains(etag)
+        else:
+            fresh = bool(if_modified_since and last_modified
+                         and last_modified.replace(microsecond=0) <= if_modified_since)
+        if fresh:
+            return 304, b'', headers
+
+        status, payload = await handler(session, args)
+        if status != 200:
+            headers = []
+        body = self.app.json.dumps(payload).encode()
+        return status, body, headers + [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]
+
+    async def all_cafes(self, session, args):
+        columns, unknown = parse_fields(args.get('fields'))
+        if unknown:
+            return 400, {"error": f"Unknown fields: {unknown}"}
+        serializer = get_cafe_serializer(tuple(column.name for column in columns))
+        try:
+            limit = parse_limit(args.get('limit'))
+            query = cafe_page_query(columns, args, limit)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+        rows, next_cursor = split_page((await session.execute(query)).all(), limit)
+        payload = dict(cafes=[serializer.from_row(row) for row in rows], limit=limit, next_cursor=next_cursor)
+        if args.get('include_total', '').lower() == 'true':
+            payload['total'] = (await session.execute(count_query(args))).scalar()
+        return 200, payload
+
+    async def all_locations(self, session, args):
+        rows = (await session.execute(cafe_counts_query(Cafe.location, args.get('country')))).all()
+        return 200, {"locations": summary_rows(rows, "location")}
+
+    async def all_countries(self, session, args):
+        rows = (await session.execute(cafe_counts_query(Cafe.country))).all()
+        return 200, {"countries": summary_rows(rows, "country")}
+
+
+app = AsyncCafeAPI(create_app())
@@ -0,0 +1,159 @@
+"""Full-text cafe search versus a LIKE scan, and what the FTS triggers cost writes
+
+    python benchmarks/fulltext.py --cafes 100000 --queries 200 --updates 10000
+
+Seeds a temporary SQLite database with cafes named from a small
+vocabulary, then times search_cafes (FTS5, bm25 ranked) against the
+substring scan over name, location and country that it replaced, for
+common words (first and deep page) and for selective terms. Also times
+an UPDATE of coffee_price with the cafes_fts_au trigger limited to the
+indexed columns and with the old trigger that fired on every UPDATE.
+Prints JSON.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADJECTIVES = ['Black', 'Little', 'Golden', 'Blue', 'Old', 'Corner', 'Urban', 'Sunny', 'Roasted', 'Velvet']
+NOUNS = ['Bean', 'Cup', 'Roastery', 'Espresso', 'Brew', 'Kitchen', 'Garden', 'House', 'Lab', 'Bakery']
+LOCATIONS = ['Kadıköy', 'Beşiktaş', 'Moda', 'Karaköy', 'Cihangir', 'Çankaya', 'Alsancak', 'Kreuzberg', 'Marais', 'Soho']
+COUNTRIES = ['Turkey', 'Germany', 'France', 'United Kingdom']
+
+OLD_UPDATE_TRIGGER = """CREATE TRIGGER cafes_fts_au AFTER UPDATE ON cafes BEGIN
+    INSERT INTO cafes_fts(cafes_fts, rowid, name, location, country)
+    VALUES ('delete', old.id, old.name, old.location, old.country);
+    INSERT INTO cafes_fts(rowid, name, location, country)
+    VALUES (new.id, new.name, new.location, new.country);
+END"""
+
+
+def seed(db, Cafe, User, count):
+    user = User(username='benchmark', email='benchmark@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    rows = [dict(
+        name=f"{random.choice(ADJECTIVES)} {random.choice(NOUNS)} {index}", map_url=f"https://maps.example/{index}",
+        img_url='https://example.com/cafe.jpg', location=random.choice(LOCATIONS), country=random.choice(COUNTRIES),
+        has_toilet=True, has_wifi=True, has_sockets=True, can_take_calls=False, coffee_price=2, user_id=user.id,
+    ) for index in range(count)]
+    for start in range(0, count, 5000):
+        db.session.execute(db.insert(Cafe), rows[start:start + 5000])
+    db.session.commit()
+
+
+def like_scan(db, Cafe, text, limit, offset):
+    pattern = f"%{text}%"
+    return db.session.execute(
+        db.select(Cafe)
+        .where(db.or_(Cafe.name.ilike(pattern), Cafe.location.ilike(pattern), Cafe.country.ilike(pattern)))
+        .order_by(Cafe.name, Cafe.id).limit(limit).offset(offset)
+    ).scalars().all()
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def time_price_update(db, Cafe, count):
+    """Seconds to reprice count cafes in one transaction, rolled back afterwards"""
+    started = time.perf_counter()
+    db.session.execute(db.update(Cafe).where(Cafe.id <= count).values(coffee_price=Cafe.coffee_price + 1))
+    db.session.flush()
+    elapsed = time.perf_counter() - started
+    db.session.rollback()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cafes', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--deep-page', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=10000)
+    args = parser.parse_args()
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(FLASK_ENV='production', DATABASE_URL=f'sqlite:///{tmp}/search.db',
+                          METRICS_ENABLED='false', RATELIMIT_BACKEND='')
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+        os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+        os.environ.pop('DATABASE_REPLICA_URL', None)
+        import main as app_main
+        from model import db, Cafe, User
+        from search import search_cafes
+
+        app = app_main.create_app()
+        with app.app_context():
+            app_main.init_db()
+            started = time.perf_counter()
+            seed(db, Cafe, User, args.cafes)
+            seed_seconds = time.perf_counter() - started
+
+            # A vocabulary word matches about a tenth of the cafes; a cafe number only a few
+            common = [random.choice(ADJECTIVES + NOUNS + LOCATIONS) for _ in range(args.queries)]
+            selective = [str(random.randrange(args.cafes)) for _ in range(args.queries)]
+            cases = [
+                ('common_first_page', common, 0),
+                ('common_deep_page', common, args.limit * (args.deep_page - 1)),
+                ('selective', selective, 0),
+            ]
+            results = {}
+            for case, queries, offset in cases:
+                fts, like = [], []
+                for text in queries:
+                    started = time.perf_counter()
+                    search_cafes(text, args.limit, offset)
+                    fts.append(time.perf_counter() - started)
+                    db.session.expunge_all()
+                    started = time.perf_counter()
+                    like_scan(db, Cafe, text, args.limit, offset)
+                    like.append(time.perf_counter() - started)
+                    db.session.expunge_all()
+                results[case] = {
+                    "offset": offset,
+                    "fts": timings(fts),
+                    "like_scan": timings(like),
+                    "speedup": round(statistics.median(like) / statistics.median(fts), 1),
+                }
+
+            updates = min(args.updates, args.cafes)
+            indexed_columns_trigger = time_price_update(db, Cafe, updates)
+            with db.engine.begin() as conn:
+                conn.execute(db.text("DROP TRIGGER cafes_fts_au"))
+                conn.execute(db.text(OLD_UPDATE_TRIGGER))
+            every_update_trigger = time_price_update(db, Cafe, updates)
+            db.session.remove()
+
+    print(json.dumps({
+        "benchmark": "fulltext",
+        "cafes": args.cafes,
+        "queries": args.queries,
+        "limit": args.limit,
+        "seed_seconds": round(seed_seconds, 2),
+        **results,
+        "price_update": {
+            "rows": updates,
+            "trigger_on_indexed_columns_ms": round(indexed_columns_trigger * 1000, 1),
+            "trigger_on_every_update_ms": round(every_update_trigger * 1000, 1),
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
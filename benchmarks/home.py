@@ -0,0 +1,118 @@
+"""Home page render time and HTML size as the catalogue grows
+
+    python benchmarks/home.py --sizes 1000,10000,100000 --requests 50
+
+Grows a temporary SQLite database to each size in turn and times GET /
+end to end and home.html's render alone, with the response cache off,
+recording the HTML size. For comparison it also renders home.html with
+every cafe, as the page did before it was paginated. Prints JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COUNTRIES = ['Turkey', 'Germany', 'France', 'United Kingdom']
+
+
+def grow(db, Cafe, user_id, start, stop):
+    """Add cafes start..stop-1"""
+    for chunk_start in range(start, stop, 5000):
+        db.session.execute(db.insert(Cafe), [dict(
+            name=f"Cafe {index}", map_url=f"https://maps.example/{index}", img_url='https://example.com/cafe.jpg',
+            location=f"District {index % 40}", country=COUNTRIES[index % len(COUNTRIES)], has_toilet=True,
+            has_wifi=index % 2 == 0, has_sockets=True, can_take_calls=False, coffee_price=2, user_id=user_id,
+        ) for index in range(chunk_start, min(chunk_start + 5000, stop))])
+    db.session.commit()
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[max(int(len(samples) * 0.95) - 1, 0)] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Comma-separated cafe counts, ascending")
+    parser.add_argument('--requests', type=int, default=50, help="Requests and renders timed at each size")
+    parser.add_argument('--full-renders', type=int, default=3, help="Renders of the whole catalogue at each size")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(FLASK_ENV='production', DATABASE_URL=f'sqlite:///{tmp}/home.db',
+                          METRICS_ENABLED='false', RATELIMIT_BACKEND='', CACHE_BACKEND='')
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+        os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+        os.environ.pop('DATABASE_REPLICA_URL', None)
+        import main as app_main
+        from flask import render_template
+        from model import db, Cafe, User
+        from routes.listing import cafe_page, count_cafes
+
+        app = app_main.create_app()
+        client = app.test_client()
+        results = []
+        with app.app_context():
+            app_main.init_db()
+            user = User(username='benchmark', email='benchmark@example.com', password='x')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            cafes = 0
+            for size in sizes:
+                grow(db, Cafe, user_id, cafes, size)
+                cafes = size
+
+                requests = []
+                for _ in range(args.requests):
+                    started = time.perf_counter()
+                    response = client.get('/')
+                    body = response.get_data()
+                    requests.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+
+                columns = list(Cafe.__table__.columns)
+                with app.test_request_context('/'):
+                    page, next_cursor, _ = cafe_page(columns, {})
+                    countries = db.session.execute(
+                        db.select(Cafe.country).distinct().order_by(Cafe.country)).scalars().all()
+                    context = dict(next_cursor=next_cursor, countries=countries, total=count_cafes({}), filters={})
+                    renders = []
+                    for _ in range(args.requests):
+                        started = time.perf_counter()
+                        render_template('home.html', cafes=page, **context)
+                        renders.append(time.perf_counter() - started)
+
+                    every_cafe = db.session.execute(db.select(*columns).order_by(Cafe.name, Cafe.id)).all()
+                    full_renders = []
+                    for _ in range(args.full_renders):
+                        started = time.perf_counter()
+                        full_html = render_template('home.html', cafes=every_cafe, **dict(context, next_cursor=None))
+                        full_renders.append(time.perf_counter() - started)
+                    db.session.remove()
+
+                results.append({
+                    "cafes": size,
+                    "request": timings(requests),
+                    "render": timings(renders),
+                    "html_bytes": len(body),
+                    "all_cafes_render": timings(full_renders),
+                    "all_cafes_html_bytes": len(full_html.encode()),
+                })
+
+    print(json.dumps({"benchmark": "home", "requests_per_size": args.requests, "sizes": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""API key issuance latency as the user table grows
+
+    python benchmarks/issuance.py --sizes 1000,10000,100000,1000000 --issues 200
+
+Grows a temporary SQLite database to each size in turn with users that
+already hold keys, then times create_and_store_api_key_for_user (unique
+api_key_hash index) for new users. For comparison it also times the
+collision check it replaced, which selected every active user with the
+same api_key_last4 over an unindexed column. Prints JSON.
+"""
+import argparse
+import json
+import os
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def grow(db, User, start, stop):
+    """Add users start..stop-1 with random key fingerprints"""
+    for chunk_start in range(start, stop, 10000):
+        db.session.execute(db.insert(User), [dict(
+            username=f"user{index}", email=f"user{index}@example.com", password='x',
+            api_key_enc='benchmark', api_key_last4=secrets.token_urlsafe(3)[:4],
+            api_key_hash=secrets.token_hex(32), api_key_active=True,
+        ) for index in range(chunk_start, min(chunk_start + 10000, stop))])
+    db.session.commit()
+
+
+def last4_scan(db, User, generate_raw_api_key):
+    """The removed collision check, without its Fernet decrypts (no candidates match here)"""
+    raw = generate_raw_api_key()
+    return db.session.execute(
+        db.select(User).filter_by(api_key_last4=raw[-4:], api_key_active=True)
+    ).scalars().all()
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help="Comma-separated user counts, ascending")
+    parser.add_argument('--issues', type=int, default=200, help="Keys issued at each size")
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(FLASK_ENV='production', DATABASE_URL=f'sqlite:///{tmp}/issuance.db',
+                          METRICS_ENABLED='false', RATELIMIT_BACKEND='')
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+        os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+        os.environ.pop('DATABASE_REPLICA_URL', None)
+        import main as app_main
+        from model import db, User, create_and_store_api_key_for_user, generate_raw_api_key
+
+        app = app_main.create_app()
+        results = []
+        with app.app_context():
+            app_main.init_db()
+            users = 0
+            for size in sizes:
+                started = time.perf_counter()
+                grow(db, User, users, size)
+                seed_seconds = time.perf_counter() - started
+                users = size
+
+                issued, scanned = [], []
+                for index in range(args.issues):
+                    user = User(username=f"new{size}_{index}", email=f"new{size}_{index}@example.com", password='x')
+                    db.session.add(user)
+                    db.session.flush()
+                    started = time.perf_counter()
+                    create_and_store_api_key_for_user(user)
+                    issued.append(time.perf_counter() - started)
+                    started = time.perf_counter()
+                    last4_scan(db, User, generate_raw_api_key)
+                    scanned.append(time.perf_counter() - started)
+                    db.session.expunge_all()
+                users += args.issues
+
+                results.append({
+                    "users": size,
+                    "seed_seconds": round(seed_seconds, 2),
+                    "issue": timings(issued),
+                    "last4_scan": timings(scanned),
+                })
+            db.session.remove()
+
+    first, last = results[0], results[-1]
+    print(json.dumps({
+        "benchmark": "issuance",
+        "issues_per_size": args.issues,
+        "sizes": results,
+        "issue_p50_growth": round(last["issue"]["p50_ms"] / first["issue"]["p50_ms"], 2),
+        "last4_scan_p50_growth": round(last["last4_scan"]["p50_ms"] / first["last4_scan"]["p50_ms"], 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
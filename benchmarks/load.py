@@ -0,0 +1,433 @@
+"""Throughput, latency and queries per request for every API and page route
+
+    python benchmarks/load.py --users 50 --cafes 5000 --requests 200
+    python benchmarks/load.py --mode http --workers 4 --concurrency 16
+    python benchmarks/load.py --mode http,asgi --no-cache
+    python benchmarks/load.py --mode mixed --workers 4 --concurrency 16 --write-ratio 0.2
+    python benchmarks/load.py --output after.json --compare before.json
+
+Seeds a temporary SQLite database, then sends --requests requests to each
+route in process through the Flask test client (client), over HTTP to
+gunicorn running --workers workers (http), and/or over HTTP to uvicorn
+serving asgi.py with as many workers (asgi). asgi only runs the routes
+asgi.py answers itself; when http runs too, "async_vs_sync" puts their
+throughput and p99 side by side. asgi.py has no response cache, so pass
+--no-cache for a like-for-like comparison.
+
+mixed sends reads and writes (--write-ratio) interleaved at random to
+gunicorn twice, on two copies of the seeded database: once with the
+SQLITE_PRAGMAS from config.py (WAL, busy_timeout, ...) and once with
+SQLite's defaults, reporting reads, writes and errors such as "database is
+locked" for each.
+
+Otherwise reads run before writes, and DELETE runs last. Queries per request come
+from the Server-Timing header. The JSON result goes to stdout and, with
+--output, to a file that a later run can --compare against.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import Fernet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COUNTRIES = ['Turkey', 'Germany', 'France', 'Italy', 'Spain']
+CITIES = [(41.01, 28.97), (52.52, 13.40), (48.86, 2.35), (41.90, 12.50), (40.42, -3.70)]
+SQL_QUERIES = re.compile(r'sql;desc="(\d+) queries"')
+MODES = ('client', 'http', 'asgi', 'mixed')
+# Routes asgi.py serves with async handlers; the rest go to the Flask app
+ASGI_ROUTES = ('GET /v1/cafes', 'GET /v1/locations', 'GET /v1/countries')
+MIXED_READS = ('GET /v1/cafes', 'GET /v1/cafes/nearby', 'GET /v1/users/<username>/info', 'GET /cafe_detail/<id>')
+MIXED_WRITES = ('PATCH /v1/cafes/<id>', 'POST /v1/cafes/<username>')
+
+
+def cafe_payload(index, tag):
+    country = index % len(COUNTRIES)
+    lat, lng = CITIES[country]
+    return {
+        "name": f"Cafe {tag} {index}",
+        "map_url": f"https://maps.google.com/?q={lat + random.uniform(-0.1, 0.1):.6f},"
+                   f"{lng + random.uniform(-0.1, 0.1):.6f}&bench={tag}-{index}",
+        "img_url": "https://example.com/cafe.jpg",
+        "location": f"District {index % 20}",
+        "country": COUNTRIES[country],
+        "has_toilet": index % 2 == 0,
+        "has_wifi": index % 3 != 0,
+        "has_sockets": index % 4 != 0,
+        "can_take_calls": index % 5 == 0,
+        "coffee_price": round(random.uniform(1.5, 6.0), 2),
+    }
+
+
+def seed(users, cafes):
+    """Create users with API keys and cafes spread across them; return [(username, key, [cafe ids])]"""
+    from model import db, User, create_and_store_api_key_for_user
+    from bulk import import_cafes
+
+    accounts = []
+    for index in range(users):
+        user = User(username=f"bench{index:05d}", email=f"bench{index:05d}@example.com", password='benchmark')
+        db.session.add(user)
+        db.session.flush()
+        accounts.append((user, create_and_store_api_key_for_user(user), []))
+
+    records = [cafe_payload(index, 'seed') for index in range(cafes)]
+    for offset, (user, _, ids) in enumerate(accounts):
+        results = import_cafes(records[offset::users], user.id, 500)
+        ids.extend(result['id'] for result in results if result['status'] == 'created')
+    return [(user.username, key, ids) for user, key, ids in accounts]
+
+
+def plan(accounts, requests, run_id):
+    """Requests per route: {route: [(method, path, json, headers)]}, in run order"""
+    def account(index):
+        return accounts[index % len(accounts)]
+
+    def owned_cafe(index):
+        username, key, ids = account(index)
+        return ids[index // len(accounts) % len(ids)], {'X-API-KEY': key}
+
+    all_ids = [cafe_id for _, _, ids in accounts for cafe_id in ids]
+    routes = {
+        'GET /v1/cafes': [
+            ('GET', f"/v1/cafes?limit=50&country={random.choice(COUNTRIES)}&sort={random.choice(['name', 'price'])}",
+             None, {}) for _ in range(requests)],
+        'GET /v1/cafes/search': [
+            ('GET', f"/v1/cafes/search?q=Cafe+{random.randint(0, 999)}", None, {}) for _ in range(requests)],
+        'GET /v1/cafes/nearby': [
+            ('GET', f"/v1/cafes/nearby?lat={lat:.3f}&lng={lng:.3f}&radius=5", None, {})
+            for lat, lng in (random.choice(CITIES) for _ in range(requests))],
+        'GET /v1/cafes/changes': [
+            ('GET', f"/v1/cafes/changes?since={random.randint(0, len(all_ids))}&limit=100", None, {})
+            for _ in range(requests)],
+        'GET /v1/locations': [('GET', '/v1/locations', None, {}) for _ in range(requests)],
+        'GET /v1/countries': [('GET', '/v1/countries', None, {}) for _ in range(requests)],
+        'GET /v1/users/<username>/info': [
+            ('GET', f"/v1/users/{account(i)[0]}/info", None, {'X-API-KEY': account(i)[1]}) for i in range(requests)],
+        'GET /': [('GET', f"/?country={random.choice(COUNTRIES)}", None, {}) for _ in range(requests)],
+        'GET /locations': [('GET', '/locations', None, {}) for _ in range(requests)],
+        'GET /cafe_detail/<id>': [
+            ('GET', f"/cafe_detail/{random.choice(all_ids)}", None, {}) for _ in range(requests)],
+        'POST /v1/users': [
+            ('POST', '/v1/users', {"username": f"new{run_id}{i:06d}", "email": f"new{run_id}{i:06d}@example.com",
+                                   "password": "benchmark"}, {}) for i in range(requests)],
+        'POST /v1/cafes/<username>': [
+            ('POST', f"/v1/cafes/{account(i)[0]}", cafe_payload(i, f'post{run_id}'), {'X-API-KEY': account(i)[1]})
+            for i in range(requests)],
+        'PATCH /v1/cafes/<id>': [
+            ('PATCH', f"/v1/cafes/{cafe_id}", {"coffee_price": round(random.uniform(1.5, 6.0), 2)}, headers)
+            for cafe_id, headers in map(owned_cafe, range(requests))],
+        'PUT /v1/cafes/<id>': [
+            ('PUT', f"/v1/cafes/{cafe_id}", cafe_payload(i, f'put{run_id}'), headers)
+            for i, (cafe_id, headers) in enumerate(map(owned_cafe, range(requests)))],
+    }
+    return routes
+
+
+def delete_plan(accounts, requests, run_id):
+    """Cafes created just for DELETE, so the read and update routes keep their data"""
+    from model import db, User
+    from bulk import import_cafes
+    username, key, _ = accounts[0]
+    user_id = db.session.execute(db.select(User.id).filter_by(username=username)).scalar()
+    results = import_cafes([cafe_payload(i, f'delete{run_id}') for i in range(requests)], user_id, 500)
+    return [('DELETE', f"/v1/cafes/{result['id']}", None, {'X-API-KEY': key}) for result in results]
+
+
+def mixed_plan(accounts, requests, write_ratio, run_id):
+    """requests reads and writes in random order: [(kind, (method, path, json, headers))]"""
+    routes = plan(accounts, requests, run_id)
+    reads = [request for route in MIXED_READS for request in routes[route]]
+    writes = [request for route in MIXED_WRITES for request in routes[route]]
+    random.shuffle(writes)
+    mixed = [('write', writes.pop()) if random.random() < write_ratio else ('read', random.choice(reads))
+             for _ in range(requests)]
+    return mixed
+
+
+def sqlite_variants(tmp, database):
+    """(name, database copy, extra env) with config.py's pragmas and with SQLite's defaults
+
+    WAL is stored in the database file, so each variant gets its own copy
+    and the defaults copy is switched back to a rollback journal.
+    """
+    variants = []
+    for name, journal_mode, env in (('pragmas', 'WAL', {}), ('sqlite_defaults', 'DELETE', {'SQLITE_PRAGMAS': 'false'})):
+        path = os.path.join(tmp, f'{name}.db')
+        source, target = sqlite3.connect(database), sqlite3.connect(path)
+        try:
+            source.backup(target)
+            target.execute(f'PRAGMA journal_mode={journal_mode}')
+        finally:
+            target.close()
+            source.close()
+        variants.append((name, path, env))
+    return variants
+
+
+def percentile(samples, fraction):
+    index = min(len(samples) - 1, max(0, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(latencies, queries, statuses, seconds):
+    latencies = sorted(latencies)
+    errors = Counter(str(status) for status in statuses if status >= 400)
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_statuses": dict(sorted(errors.items())),
+        "throughput_rps": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def sql_queries(headers):
+    match = SQL_QUERIES.search(headers.get('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+def run_client(app, routes):
+    client = app.test_client()
+    results = {}
+    for route, requests in routes.items():
+        latencies, queries, statuses = [], [], []
+        started = time.perf_counter()
+        for method, path, body, headers in requests:
+            sent = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers=headers)
+            latencies.append(time.perf_counter() - sent)
+            statuses.append(response.status_code)
+            count = sql_queries(response.headers)
+            if count is not None:
+                queries.append(count)
+        results[route] = summarize(latencies, queries, statuses, time.perf_counter() - started)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(mode, port, workers):
+    if mode == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--no-access-log', '--log-level', 'warning']
+    return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers)]
+
+
+def start_server(mode, env, workers):
+    """Start gunicorn (http) or uvicorn (asgi) on a free port; return (process, base_url)"""
+    port = free_port()
+    server = subprocess.Popen(
+        server_command(mode, port, workers),
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return server, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    name = 'uvicorn' if mode == 'asgi' else 'gunicorn'
+    raise RuntimeError(f"{name} did not start; is it installed?")
+
+
+def http_sender(base_url):
+    """send(request) -> (latency, status, sql queries), with one keep-alive session per thread"""
+    import requests as http
+    local = threading.local()
+
+    def send(request):
+        method, path, body, headers = request
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = http.Session()
+        sent = time.perf_counter()
+        response = session.request(method, base_url + path, json=body, headers=headers)
+        return time.perf_counter() - sent, response.status_code, sql_queries(response.headers)
+    return send
+
+
+def summarize_outcomes(outcomes, seconds):
+    return summarize(
+        [latency for latency, _, _ in outcomes],
+        [count for _, _, count in outcomes if count is not None],
+        [status for _, status, _ in outcomes],
+        seconds,
+    )
+
+
+def run_http(base_url, routes, concurrency):
+    send = http_sender(base_url)
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for route, requests in routes.items():
+            started = time.perf_counter()
+            outcomes = list(pool.map(send, requests))
+            results[route] = summarize_outcomes(outcomes, time.perf_counter() - started)
+    return results
+
+
+def run_mixed(base_url, requests, concurrency):
+    """Send interleaved reads and writes concurrently; summarize all of them, reads and writes"""
+    send = http_sender(base_url)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        outcomes = list(pool.map(send, [request for _, request in requests]))
+        seconds = time.perf_counter() - started
+    results = {"all": summarize_outcomes(outcomes, seconds)}
+    for kind in ('read', 'write'):
+        results[kind] = summarize_outcomes(
+            [outcome for (request_kind, _), outcome in zip(requests, outcomes) if request_kind == kind], seconds
+        )
+    return results
+
+
+def async_vs_sync(results):
+    """Throughput and p99 of the routes asgi.py serves, under gunicorn and uvicorn"""
+    return {
+        route: {
+            "sync_rps": results['http'][route]['throughput_rps'],
+            "async_rps": results['asgi'][route]['throughput_rps'],
+            "sync_p99_ms": results['http'][route]['p99_ms'],
+            "async_p99_ms": results['asgi'][route]['p99_ms'],
+        }
+        for route in ASGI_ROUTES
+    }
+
+
+def compare(current, baseline):
+    """Percent change per route and metric against a previous run's JSON"""
+    changes = {}
+    for mode, routes in current['results'].items():
+        for route, stats in routes.items():
+            before = baseline.get('results', {}).get(mode, {}).get(route)
+            if not before:
+                continue
+            changes.setdefault(mode, {})[route] = {
+                metric: round((stats[metric] - before[metric]) / before[metric] * 100, 1)
+                for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+                if stats.get(metric) is not None and before.get(metric)
+            }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--cafes', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route')
+    parser.add_argument('--mode', default='client',
+                        help=f"Comma separated modes from {', '.join(MODES)}; 'both' is client,http")
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn / uvicorn workers in http and asgi mode')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent connections in http mode')
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of writes in mixed mode')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the response cache')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Also write the JSON result to this file')
+    parser.add_argument('--compare', help='JSON result of an earlier run to report percent changes against')
+    args = parser.parse_args()
+    modes = ['client', 'http'] if args.mode == 'both' else args.mode.split(',')
+    if not modes or any(mode not in MODES for mode in modes):
+        parser.error(f"--mode must be 'both' or a comma separated list of {', '.join(MODES)}")
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            FLASK_ENV='production', DATABASE_URL=f'sqlite:///{tmp}/load.db',
+            METRICS_ENABLED='true', SERVER_TIMING_ENABLED='true', RATELIMIT_BACKEND='',
+        )
+        if args.no_cache:
+            os.environ['CACHE_BACKEND'] = ''
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+        os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+        os.environ.pop('DATABASE_REPLICA_URL', None)
+
+        import main as app_main
+        app = app_main.create_app()
+        results = {}
+        with app.app_context():
+            app_main.init_db()
+            started = time.perf_counter()
+            accounts = seed(args.users, args.cafes)
+            seed_seconds = time.perf_counter() - started
+
+        for run_id, mode in enumerate(modes):
+            if mode == 'mixed':
+                with app.app_context():
+                    requests = mixed_plan(accounts, args.requests, args.write_ratio, run_id)
+                results[mode] = {}
+                for name, database, extra_env in sqlite_variants(tmp, f'{tmp}/load.db'):
+                    env = dict(os.environ, WEB_CONCURRENCY=str(args.workers),
+                               DATABASE_URL=f'sqlite:///{database}', **extra_env)
+                    server, base_url = start_server('http', env, args.workers)
+                    try:
+                        results[mode][name] = run_mixed(base_url, requests, args.concurrency)
+                    finally:
+                        server.terminate()
+                        server.wait()
+                continue
+            with app.app_context():
+                routes = plan(accounts, args.requests, run_id)
+                if mode == 'asgi':
+                    routes = {route: routes[route] for route in ASGI_ROUTES}
+                else:
+                    routes['DELETE /v1/cafes/<id>'] = delete_plan(accounts, args.requests, run_id)
+            # Requests run outside the setup app context so each one gets a fresh g
+            if mode == 'client':
+                results[mode] = run_client(app, routes)
+            else:
+                env = dict(os.environ, WEB_CONCURRENCY=str(args.workers))
+                server, base_url = start_server(mode, env, args.workers)
+                try:
+                    results[mode] = run_http(base_url, routes, args.concurrency)
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    output = {
+        "benchmark": "load",
+        "config": {
+            "users": args.users, "cafes": args.cafes, "requests_per_route": args.requests,
+            "workers": args.workers, "concurrency": args.concurrency, "write_ratio": args.write_ratio,
+            "response_cache": not args.no_cache, "seed": args.seed,
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "results": results,
+    }
+    if 'http' in results and 'asgi' in results:
+        output["async_vs_sync"] = async_vs_sync(results)
+    if args.compare:
+        with open(args.compare) as f:
+            output["change_percent"] = compare(output, json.load(f))
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
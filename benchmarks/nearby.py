@@ -0,0 +1,122 @@
+"""Indexed nearby search versus a brute-force haversine scan
+
+    python benchmarks/nearby.py --cafes 100000 --queries 200 --radius 5
+
+Seeds a temporary SQLite database with cafes clustered around a few
+cities, then times nearby_cafes against loading every cafe's coordinates
+and ranking them in Python. Prints JSON.
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CITIES = [(41.01, 28.97), (39.93, 32.86), (38.42, 27.14), (52.52, 13.40), (48.86, 2.35), (40.71, -74.01)]
+
+
+def seed(db, Cafe, User, count):
+    from geo import map_url_location
+    user = User(username='benchmark', email='benchmark@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    rows = []
+    for index in range(count):
+        lat, lng = random.choice(CITIES)
+        map_url = f"https://maps.google.com/?q={lat + random.gauss(0, 0.2):.6f},{lng + random.gauss(0, 0.2):.6f}"
+        rows.append(dict(
+            name=f"Cafe {index}", map_url=map_url, img_url='https://example.com/cafe.jpg', location='Center',
+            country='Benchmark', has_toilet=True, has_wifi=True, has_sockets=True, can_take_calls=False,
+            coffee_price=2, user_id=user.id, **map_url_location(map_url),
+        ))
+    for start in range(0, count, 5000):
+        db.session.execute(db.insert(Cafe), rows[start:start + 5000])
+    db.session.commit()
+
+
+def brute_force(db, Cafe, haversine_km, lat, lng, radius_km, limit):
+    matches = []
+    for cafe_id, cafe_lat, cafe_lng in db.session.execute(
+        db.select(Cafe.id, Cafe.latitude, Cafe.longitude).where(Cafe.latitude.is_not(None))
+    ):
+        distance = haversine_km(lat, lng, cafe_lat, cafe_lng)
+        if distance <= radius_km:
+            matches.append((cafe_id, distance))
+    return heapq.nsmallest(limit, matches, key=lambda match: match[1])
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cafes', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=5.0)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(FLASK_ENV='production', DATABASE_URL=f'sqlite:///{tmp}/nearby.db',
+                          METRICS_ENABLED='false', RATELIMIT_BACKEND='')
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+        os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+        os.environ.pop('DATABASE_REPLICA_URL', None)
+        import main as app_main
+        from model import db, Cafe, User
+        from geo import haversine_km
+        from routes.listing import nearby_cafes
+
+        app = app_main.create_app()
+        with app.app_context():
+            app_main.init_db()
+            started = time.perf_counter()
+            seed(db, Cafe, User, args.cafes)
+            seed_seconds = time.perf_counter() - started
+
+            points = [(lat + random.gauss(0, 0.2), lng + random.gauss(0, 0.2))
+                      for lat, lng in (random.choice(CITIES) for _ in range(args.queries))]
+            indexed, brute, mismatches, results = [], [], 0, 0
+            for lat, lng in points:
+                started = time.perf_counter()
+                found = nearby_cafes([Cafe.id], lat, lng, args.radius, args.limit, {})
+                indexed.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                expected = brute_force(db, Cafe, haversine_km, lat, lng, args.radius, args.limit)
+                brute.append(time.perf_counter() - started)
+                results += len(found)
+                mismatches += [row.id for row, _ in found] != [cafe_id for cafe_id, _ in expected]
+            db.session.remove()
+
+    print(json.dumps({
+        "benchmark": "nearby",
+        "cafes": args.cafes,
+        "queries": args.queries,
+        "radius_km": args.radius,
+        "limit": args.limit,
+        "seed_seconds": round(seed_seconds, 2),
+        "avg_results": round(results / args.queries, 1),
+        "mismatches": mismatches,
+        "indexed": timings(indexed),
+        "brute_force": timings(brute),
+        "speedup": round(statistics.median(brute) / statistics.median(indexed), 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
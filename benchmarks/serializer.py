@@ -0,0 +1,107 @@
+"""RowSerializer versus the old column-walking Cafe.to_dict
+
+    python benchmarks/serializer.py --cafes 100000 --repeat 5
+
+Loads cafes from a temporary SQLite database once, both as ORM objects
+and as Row tuples from a column-only select, then times turning them
+into the JSON body the listing endpoints send: the old to_dict (getattr
+per column per row, Decimal and datetime left to Flask's JSON provider)
+against CAFE_SERIALIZER.from_object and from_row. Best of --repeat runs.
+Prints JSON.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(db, Cafe, User, count):
+    user = User(username='benchmark', email='benchmark@example.com', password='x')
+    db.session.add(user)
+    db.session.flush()
+    rows = [dict(
+        name=f"Cafe {index}", map_url=f"https://maps.google.com/?q=41.{index:06d},28.970000",
+        img_url='https://example.com/cafe.jpg', location='Center', country='Benchmark', has_toilet=True,
+        has_wifi=index % 2 == 0, has_sockets=True, can_take_calls=False, coffee_price=f"{2 + index % 300 / 100:.2f}",
+        user_id=user.id, latitude=41 + index / 1e6, longitude=28.97, geohash='sxk9',
+    ) for index in range(count)]
+    for start in range(0, count, 5000):
+        db.session.execute(db.insert(Cafe), rows[start:start + 5000])
+    db.session.commit()
+
+
+def old_to_dict(cafe):
+    """Cafe.to_dict before RowSerializer"""
+    dictionary = {}
+    for column in cafe.__table__.columns:
+        dictionary[column.name] = getattr(cafe, column.name)
+    return dictionary
+
+
+def best_of(repeat, build, dumps):
+    """(seconds to build the dicts, seconds to build and encode them, body) for the fastest run"""
+    build_seconds, total_seconds = float('inf'), float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        values = build()
+        built = time.perf_counter()
+        body = dumps({"cafes": values})
+        build_seconds = min(build_seconds, built - started)
+        total_seconds = min(total_seconds, time.perf_counter() - started)
+    return build_seconds, total_seconds, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cafes', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(FLASK_ENV='production', DATABASE_URL=f'sqlite:///{tmp}/serializer.db',
+                          METRICS_ENABLED='false', RATELIMIT_BACKEND='')
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+        os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+        os.environ.pop('DATABASE_REPLICA_URL', None)
+        import main as app_main
+        from model import db, Cafe, User, CAFE_SERIALIZER
+
+        app = app_main.create_app()
+        with app.app_context():
+            app_main.init_db()
+            seed(db, Cafe, User, args.cafes)
+            cafes = db.session.execute(db.select(Cafe).order_by(Cafe.id)).scalars().all()
+            rows = db.session.execute(db.select(*Cafe.__table__.columns).order_by(Cafe.id)).all()
+            dumps = app.json.dumps
+
+            cases = {
+                "to_dict": lambda: [old_to_dict(cafe) for cafe in cafes],
+                "from_object": lambda: [CAFE_SERIALIZER.from_object(cafe) for cafe in cafes],
+                "from_row": lambda: [CAFE_SERIALIZER.from_row(row) for row in rows],
+            }
+            results, bodies = {}, {}
+            for name, build in cases.items():
+                build_seconds, total_seconds, bodies[name] = best_of(args.repeat, build, dumps)
+                results[name] = {"build_ms": round(build_seconds * 1000, 1), "build_and_encode_ms": round(total_seconds * 1000, 1)}
+            db.session.remove()
+
+    baseline = results["to_dict"]["build_and_encode_ms"]
+    for name in ("from_object", "from_row"):
+        results[name]["speedup"] = round(baseline / results[name]["build_and_encode_ms"], 2)
+    print(json.dumps({
+        "benchmark": "serializer",
+        "cafes": args.cafes,
+        "repeat": args.repeat,
+        "identical_output": len(set(bodies.values())) == 1,
+        **results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Time from `import main` to the first served request
+
+    python benchmarks/startup.py --runs 10 --path /v1/countries
+
+Every run is a fresh interpreter against a SQLite file set up once with
+init-db, and the result is printed as JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+status = app.test_client().get(sys.argv[1]).status_code
+served = time.perf_counter()
+print(json.dumps({"status": status, "import": imported - start, "create_app": created - imported,
+                  "first_request": served - created, "total": served - start}))
+'''
+
+
+def summarize(samples):
+    return {
+        "min_ms": round(min(samples) * 1000, 2),
+        "median_ms": round(statistics.median(samples) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/v1/countries')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, FLASK_ENV='production', DATABASE_URL=f'sqlite:///{tmp}/bench.db')
+        env.setdefault('SECRET_KEY', 'benchmark')
+        env.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+        env.pop('DATABASE_REPLICA_URL', None)
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'init-db'],
+                       cwd=ROOT, env=env, check=True, capture_output=True)
+
+        runs = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', RUN, args.path],
+                                    cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+            run['process'] = time.perf_counter() - start
+            runs.append(run)
+
+    phases = ('import', 'create_app', 'first_request', 'total', 'process')
+    print(json.dumps({
+        "benchmark": "startup",
+        "path": args.path,
+        "runs": args.runs,
+        "statuses": sorted({run['status'] for run in runs}),
+        **{phase: summarize([run[phase] for run in runs]) for phase in phases},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from model import db, Cafe, mark_cafes_changed, log_cafe_changes, quantize_price
+from geo import map_url_location
+
+CAFE_FIELDS = ["can_take_calls", "coffee_price", "country", "has_sockets", "has_toilet",
+               "has_wifi", "img_url", "location", "map_url", "name"]
+BOOL_FIELDS = ["can_take_calls", "has_sockets", "has_toilet", "has_wifi"]
+STRING_FIELDS = ["country", "img_url", "location", "map_url", "name"]
+PRICE_TYPE = Cafe.__table__.c.coffee_price.type
+# Largest value Numeric(precision, scale) can store
+MAX_PRICE = Decimal(10) ** (PRICE_TYPE.precision - PRICE_TYPE.scale) - Decimal(1).scaleb(-PRICE_TYPE.scale)
+
+
+def parse_records(payload, fmt):
+    """Parse a JSON array, NDJSON or CSV payload into a list of dicts"""
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8-sig')
+    if fmt == 'json':
+        records = json.loads(payload)
+        if isinstance(records, dict):
+            records = records.get('cafes')
+        if not isinstance(records, list):
+            raise ValueError("Expected a JSON array of cafes")
+        return records
+    if fmt == 'ndjson':
+        return [json.loads(line) for line in payload.splitlines() if line.strip()]
+    if fmt == 'csv':
+        return list(csv.DictReader(io.StringIO(payload)))
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', '1', 'yes'):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ('false', '0', 'no', ''):
+        return False
+    raise ValueError(f"invalid boolean {value!r}")
+
+
+def clean_record(record):
+    """Return (values, error) for one incoming cafe record"""
+    if not isinstance(record, dict):
+        return None, "Row is not an object"
+    missing = [field for field in CAFE_FIELDS if field not in record]
+    if missing:
+        return None, f"Missing required fields: {missing}"
+
+    values = {}
+    for field in STRING_FIELDS:
+        value = record[field]
+        if not isinstance(value, str) or not value.strip():
+            return None, f"{field} must be a non-empty string"
+        if len(value) > 250:
+            return None, f"{field} is longer than 250 characters"
+        values[field] = value.strip()
+    for field in BOOL_FIELDS:
+        try:
+            values[field] = to_bool(record[field])
+        except ValueError as e:
+            return None, f"{field}: {e}"
+    try:
+        price = Decimal(str(record['coffee_price']))
+    except InvalidOperation:
+        return None, "coffee_price must be a number"
+    if not price.is_finite():
+        return None, "coffee_price must be a finite number"
+    # Rounded as the ORM rounds Cafe.coffee_price, so both paths store the same value
+    price = quantize_price(price)
+    if not 0 <= price <= MAX_PRICE:
+        return None, f"coffee_price must be between 0 and {MAX_PRICE}"
+    values['coffee_price'] = price
+    # Core inserts skip the ORM hook that derives these on Cafe
+    values.update(map_url_location(values['map_url']))
+    return values, None
+
+
+def is_map_url_conflict(error):
+    """Whether an IntegrityError came from the unique map_url constraint"""
+    return 'map_url' in str(error.orig)
+
+
+def existing_map_urls(map_urls, chunk_size):
+    """Set of map_urls already stored, checked with one IN query per chunk"""
+    found = set()
+    for start in range(0, len(map_urls), chunk_size):
+        chunk = map_urls[start:start + chunk_size]
+        found.update(db.session.execute(
+            db.select(Cafe.map_url).where(Cafe.map_url.in_(chunk))
+        ).scalars())
+    return found
+
+
+def import_cafes(records, user_id, chunk_size):
+    """Validate and insert cafe records for user_id in one transaction
+
+    Returns one result dict per record, in input order. Valid rows are
+    inserted with executemany in chunks of chunk_size.
+    """
+    results = [None] * len(records)
+    pending = []
+    seen = set()
+    for index, record in enumerate(records):
+        values, error = clean_record(record)
+        if error is None and values['map_url'] in seen:
+            error = "Duplicate map_url in upload"
+        if error:
+            results[index] = {"index": index, "status": "error", "error": error}
+            continue
+        seen.add(values['map_url'])
+        values['user_id'] = user_id
+        pending.append((index, values))
+
+    taken = existing_map_urls([values['map_url'] for _, values in pending], chunk_size)
+    rows = []
+    for index, values in pending:
+        if values['map_url'] in taken:
+            results[index] = {"index": index, "status": "error", "error": "Cafe already exists"}
+        else:
+            rows.append((index, values))
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        # Matching ids back by the unique map_url instead of sort_by_parameter_order,
+        # which SQLite can only honour by sending one INSERT per row
+        ids = dict(db.session.execute(
+            db.insert(Cafe).returning(Cafe.map_url, Cafe.id),
+            [values for _, values in chunk],
+        ).all())
+        for index, values in chunk:
+            results[index] = {"index": index, "status": "created", "id": ids[values['map_url']]}
+
+    if rows:
+        mark_cafes_changed(db.session)
+        log_cafe_changes(db.session, 'insert', [result["id"] for result in results if result["status"] == "created"])
+    db.session.commit()
+    return results
@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from importlib import import_module
+
+from flask import request, session, make_response, Response, g
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class CacheBackend:
+    """Interface for response cache stores"""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCacheBackend(CacheBackend):
+    """In-process store evicting the least recently used entry, with per-entry TTL"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedCacheBackend(CacheBackend):
+    """Interface for stores shared between workers (Redis, memcached, ...)
+
+    Values are bytes so implementations can hand them to any network store.
+    """
+
+
+class LocalSharedCacheBackend(SharedCacheBackend):
+    """In-memory stand-in for a shared store, for local runs and tests"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.store = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.store.get(key)
+            if entry is None or entry[1] <= time.time():
+                self.store.pop(key, None)
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.store.pop(key, None)
+            self.store[key] = (value, time.time() + ttl)
+            while len(self.store) > self.max_entries:
+                del self.store[next(iter(self.store))]
+
+    def delete(self, key):
+        with self.lock:
+            self.store.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+
+
+BACKENDS = {
+    'lru': 'cache.LRUCacheBackend',
+    'local-shared': 'cache.LocalSharedCacheBackend',
+}
+
+
+def load_backend(name, aliases, max_entries):
+    """Instantiate a backend by an alias in aliases or a dotted import path"""
+    path = aliases.get(name, name)
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)(max_entries=max_entries)
+
+
+class ResponseCache:
+    """Caches serialized GET responses keyed by route and query string"""
+
+    def __init__(self):
+        self.backend = None
+        self.ttl = 0
+
+    def init_app(self, app):
+        name = app.config['CACHE_BACKEND']
+        self.backend = load_backend(name, BACKENDS, app.config['CACHE_MAX_ENTRIES']) if name else None
+        self.ttl = app.config['CACHE_DEFAULT_TTL']
+        app.extensions['response_cache'] = self
+
+    def invalidate(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def version(self):
+        if 'cafes_version' not in g:
+            from model import get_cafes_version
+            g.cafes_version = get_cafes_version()[0]
+        return g.cafes_version
+
+    def encode(self, entry):
+        if isinstance(self.backend, SharedCacheBackend):
+            status, mimetype, body = entry
+            return json.dumps([status, mimetype, body.decode()]).encode()
+        return entry
+
+    def decode(self, value):
+        if isinstance(self.backend, SharedCacheBackend):
+            status, mimetype, body = json.loads(value)
+            return status, mimetype, body.encode()
+        return value
+
+    def cached(self, per_user=False):
+        """Serve the view from cache; per_user keys entries by logged in user
+
+        Entries are also keyed by the catalogue version, taken from
+        cached_by_cafes_version when it wraps the view, so a write committed
+        by another worker (or while this one rendered) is never answered
+        with an older body.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or request.method != 'GET' or session.get('_flashes'):
+                    return view(*args, **kwargs)
+
+                user_id = current_user.get_id() if per_user and current_user.is_authenticated else ''
+                key = f"{request.path}?{request.query_string.decode()}:{user_id}:{self.version()}"
+                hit = self.backend.get(key)
+                if hit is not None:
+                    status, mimetype, body = self.decode(hit)
+                    return Response(body, status=status, mimetype=mimetype)
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    entry = (response.status_code, response.mimetype, response.get_data())
+                    self.backend.set(key, self.encode(entry), self.ttl)
+                return response
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_on_cafe_commit(db_session):
+    """Drop cached listings once a transaction that wrote a Cafe has committed"""
+    if db_session.info.pop('cafes_changed', False):
+        response_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def reset_cafe_changes(db_session):
+    db_session.info.pop('cafes_changed', None)
@@ -10,10 +10,92 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    # Optional read replica used by read-only views; REPLICA_SYNC='sqlite-backup'
+    # copies the primary SQLite file to the replica after each write (local testing only)
+    SQLALCHEMY_BINDS = {'replica': os.environ['DATABASE_REPLICA_URL']} if os.environ.get('DATABASE_REPLICA_URL') else {}
+    REPLICA_SYNC = os.environ.get('REPLICA_SYNC')
+    # Used by asgi.py; derived from the replica or DATABASE_URL when unset
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+
+    # Applied to every new SQLite connection; WAL lets readers run alongside a writer.
+    # SQLITE_PRAGMAS=false keeps SQLite's defaults (used by benchmarks/load.py --mode mixed)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    } if os.environ.get('SQLITE_PRAGMAS', 'true').lower() == 'true' else {}
     
     # Fernet encryption key for API keys
     FERNET_KEY = os.environ.get('FERNET_KEY')
+
+    # HMAC secret for API key lookup hashes (falls back to FERNET_KEY)
+    API_KEY_HASH_SECRET = os.environ.get('API_KEY_HASH_SECRET')
     
+    # GET /v1/cafes pagination
+    CAFES_PAGE_SIZE = 50
+    CAFES_MAX_PAGE_SIZE = 500
+    CAFES_STREAM_BATCH_SIZE = 1000
+
+    # GET /v1/cafes/nearby search radius in km
+    NEARBY_DEFAULT_RADIUS_KM = 5
+    NEARBY_MAX_RADIUS_KM = 50
+
+    # HTTP caching for catalogue reads (ETag / Last-Modified)
+    CACHE_CONTROL_API = os.environ.get('CACHE_CONTROL_API', 'public, max-age=60')
+    CACHE_CONTROL_PAGES = os.environ.get('CACHE_CONTROL_PAGES', 'private, no-cache')
+
+    # Response cache for catalogue listings: 'lru', 'local-shared',
+    # a dotted path to a SharedCacheBackend subclass, or empty to disable
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'lru')
+    CACHE_DEFAULT_TTL = 60
+    CACHE_MAX_ENTRIES = 1024
+
+    # POST /v1/cafes/bulk and the import-cafes command
+    BULK_IMPORT_CHUNK_SIZE = 500
+    BULK_IMPORT_MAX_ROWS = 10000
+
+    # Seconds a session login's user record is reused by this process
+    # before re-reading it; changes made through this process apply at once
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+    USER_CACHE_MAX_ENTRIES = 4096
+
+    # Background jobs (jobs table): threads per process, or 0 to leave them
+    # to a separate `flask run-jobs --forever` worker
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+    JOBS_POLL_INTERVAL = 5
+    JOBS_MAX_ATTEMPTS = 3
+    # Seconds before a running job whose process died is picked up again
+    JOBS_STALE_AFTER = 300
+    # Seconds finished jobs are kept
+    JOBS_RETENTION = 86400
+
+    # /v1 rate limits per valid API key (or client IP without one): 'memory',
+    # 'local-shared', a dotted path to a SharedRateLimitBackend subclass, or empty to disable
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    RATELIMIT_MAX_ENTRIES = 10000
+    RATELIMIT_DEFAULT = os.environ.get('RATELIMIT_DEFAULT', '120/minute')
+    RATELIMIT_ROUTES = {
+        'api.add_user': '5/minute',
+        'api.search_cafes_api': '60/minute',
+        'api.bulk_add_cafes_api': '10/hour',
+        'api.export_cafes_api': '10/hour',
+        'api.add_cafe_api': '30/minute',
+        'api.update_cafe_api': '30/minute',
+        'api.delete_cafe': '30/minute',
+    }
+    # Requests per API key per day across all /v1 routes, 0 for no quota
+    RATELIMIT_DAILY_QUOTA = int(os.environ.get('RATELIMIT_DAILY_QUOTA', 10000))
+    # Reverse proxies in front of the app (1 on Render); the client IP that rate limits
+    # use is then taken from X-Forwarded-For. 0 trusts no forwarding headers
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+
+    # Per-endpoint metrics at /metrics and Server-Timing response headers
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
     # Session configuration
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
     
@@ -25,16 +107,29 @@ class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///cafes.db'
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': True,
+    }
 
 class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///cafes.db'
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_BINDS = {}
+    REPLICA_SYNC = None
+    JOBS_WORKERS = 0
     WTF_CSRF_ENABLED = False
 
 # Configuration dictionary
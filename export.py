@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+import time
+import zlib
+from datetime import datetime
+from decimal import Decimal
+
+from model import db, Cafe
+
+EXPORT_FORMATS = ('csv', 'columns')
+EXPORT_COLUMNS = list(Cafe.__table__.columns)
+EXPORT_NAMES = [column.name for column in EXPORT_COLUMNS]
+
+
+class ExportStats:
+    """Row count and throughput of a finished or running export"""
+
+    def __init__(self):
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def export_query(country=None, since=None, until=None):
+    """Cafes to export, optionally filtered by country and created_at range"""
+    query = db.select(*EXPORT_COLUMNS).order_by(Cafe.id)
+    if country:
+        query = query.where(Cafe.country == country)
+    if since:
+        query = query.where(Cafe.created_at >= since)
+    if until:
+        query = query.where(Cafe.created_at < until)
+    return query
+
+
+def export_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_export(query, fmt, batch_size, stats):
+    """Yield text chunks of the export, fetching batch_size rows at a time from a server-side cursor
+
+    csv writes a header and one line per cafe; columns writes one JSON
+    object per batch mapping each column name to its list of values.
+    """
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_NAMES)
+        for batch in result.partitions():
+            writer.writerows([export_value(value) for value in row] for row in batch)
+            stats.rows += len(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif fmt == 'columns':
+        for batch in result.partitions():
+            columns = zip(*batch)
+            yield json.dumps({
+                name: [export_value(value) for value in values]
+                for name, values in zip(EXPORT_NAMES, columns)
+            }) + '\n'
+            stats.rows += len(batch)
+    else:
+        raise ValueError(f"format must be one of {EXPORT_FORMATS}")
+    stats.finished = time.perf_counter()
+
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks without buffering the whole output"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,110 @@
+import math
+import re
+from urllib.parse import urlsplit, parse_qs, unquote
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+COORDINATES = r'(-?\d{1,3}(?:\.\d+)?),\s*(-?\d{1,3}(?:\.\d+)?)'
+URL_PATTERNS = (
+    re.compile(r'!3d(-?\d+(?:\.\d+)?)!4d(-?\d+(?:\.\d+)?)'),  # place data, the pin itself
+    re.compile(r'@' + COORDINATES),                           # viewport centre
+)
+QUERY_PARAMS = ('q', 'query', 'll', 'destination', 'center')
+
+
+def valid_coordinates(lat, lng):
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def parse_map_url(map_url):
+    """Extract (lat, lng) from a Google Maps style URL, or None"""
+    if not map_url:
+        return None
+    url = unquote(map_url)
+    for pattern in URL_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            lat, lng = float(match.group(1)), float(match.group(2))
+            return (lat, lng) if valid_coordinates(lat, lng) else None
+    params = parse_qs(urlsplit(url).query)
+    for name in QUERY_PARAMS:
+        for value in params.get(name, []):
+            match = re.fullmatch(r'\s*' + COORDINATES + r'\s*', value)
+            if match:
+                lat, lng = float(match.group(1)), float(match.group(2))
+                return (lat, lng) if valid_coordinates(lat, lng) else None
+    return None
+
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(lat_degrees, lng_degrees) spanned by one geohash cell"""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def search_cells(lat, lng, radius_km):
+    """Geohash prefixes whose cells together cover every point within radius_km
+
+    Uses the longest prefix whose cells are at least radius_km on each
+    side, so the centre cell and its eight neighbours are enough.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_deg, lng_deg = cell_size(precision)
+        width_km = lng_deg * KM_PER_DEGREE * math.cos(math.radians(min(abs(lat) + lat_deg, 90)))
+        if lat_deg * KM_PER_DEGREE >= radius_km and width_km >= radius_km:
+            break
+    else:
+        return ['']
+
+    cells = set()
+    for dlat in (-lat_deg, 0, lat_deg):
+        for dlng in (-lng_deg, 0, lng_deg):
+            cell_lat = max(-90.0, min(90.0, lat + dlat))
+            cell_lng = (lng + dlng + 180) % 360 - 180
+            cells.add(geohash_encode(cell_lat, cell_lng, precision))
+    return sorted(cells)
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat) around a point; longitude is left to the cell and distance checks"""
+    lat_delta = radius_km / KM_PER_DEGREE
+    return max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def map_url_location(map_url):
+    """latitude, longitude and geohash column values for a map_url"""
+    coordinates = parse_map_url(map_url)
+    if coordinates is None:
+        return {'latitude': None, 'longitude': None, 'geohash': None}
+    lat, lng = coordinates
+    return {'latitude': lat, 'longitude': lng, 'geohash': geohash_encode(lat, lng)}
@@ -0,0 +1,14 @@
+"""Gunicorn settings, used with: gunicorn -c gunicorn.conf.py"""
+import os
+
+wsgi_app = 'main:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Import and build the app once in the master; workers fork from it
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from main import dispose_engines
+        dispose_engines(server.app.wsgi())
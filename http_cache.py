@@ -0,0 +1,64 @@
+import hashlib
+from functools import wraps
+
+from flask import request, session, current_app, make_response, g
+from flask_login import current_user
+from model import get_cafes_version
+
+
+def etag_for(version, full_path, user_id=''):
+    return hashlib.sha1(f"{version}:{full_path}:{user_id}".encode()).hexdigest()
+
+
+def cafes_etag(version, per_user):
+    """Strong ETag for this URL at a catalogue version, optionally per logged in user"""
+    user_id = current_user.get_id() if per_user and current_user.is_authenticated else ''
+    return etag_for(version, request.full_path, user_id)
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def apply_cache_headers(response, etag, last_modified, cache_control, per_user):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    if per_user:
+        response.vary.add('Cookie')
+    return response
+
+
+def cached_by_cafes_version(cache_control_key, per_user=False):
+    """Answer GETs with 304 while the cafe catalogue version is unchanged
+
+    The view only runs when the client's ETag / Last-Modified is stale.
+    Cache-Control comes from the given config key; per_user varies the
+    ETag by logged in user for pages that render current_user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages must be rendered, never answered from cache
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            version, last_modified = get_cafes_version()
+            # response_cache keys entries by this version, so a body is never served under a newer ETag
+            g.cafes_version = version
+            etag = cafes_etag(version, per_user)
+            cache_control = current_app.config[cache_control_key]
+            if not_modified(etag, last_modified):
+                return apply_cache_headers(make_response('', 304), etag, last_modified, cache_control, per_user)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                apply_cache_headers(response, etag, last_modified, cache_control, per_user)
+            return response
+        return wrapper
+    return decorator
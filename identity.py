@@ -0,0 +1,82 @@
+from functools import cached_property
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from cache import LRUCacheBackend
+from model import db, User, Cafe
+
+SESSION_USER_COLUMNS = (
+    User.id, User.username, User.email, User.api_key_last4, User.api_key_hash,
+    User.api_key_created_at, User.api_key_active,
+)
+
+
+class SessionUser(UserMixin):
+    """Lightweight current_user for session logins, built from SESSION_USER_COLUMNS
+
+    A new instance is made per request from cached values; cafes and
+    api_key_enc are queried on first access.
+    """
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    @cached_property
+    def cafes(self):
+        return db.session.execute(db.select(Cafe).filter_by(user_id=self.id).order_by(Cafe.id)).scalars().all()
+
+    @cached_property
+    def api_key_enc(self):
+        return db.session.execute(db.select(User.api_key_enc).filter_by(id=self.id)).scalar()
+
+
+class IdentityCache:
+    """Per-process TTL cache of SessionUser values for the login_manager user loader"""
+
+    def __init__(self):
+        self.backend = None
+        self.ttl = 0
+
+    def init_app(self, app):
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.backend = LRUCacheBackend(app.config['USER_CACHE_MAX_ENTRIES']) if self.ttl else None
+        app.extensions['identity_cache'] = self
+
+    def load(self, user_id):
+        values = self.backend.get(user_id) if self.backend is not None else None
+        if values is None:
+            row = db.session.execute(db.select(*SESSION_USER_COLUMNS).filter_by(id=user_id)).first()
+            if row is None:
+                return None
+            values = row._asdict()
+            if self.backend is not None:
+                self.backend.set(user_id, values, self.ttl)
+        return SessionUser(values)
+
+    def invalidate(self, user_ids):
+        if self.backend is not None:
+            for user_id in user_ids:
+                self.backend.delete(user_id)
+
+
+identity_cache = IdentityCache()
+
+
+@event.listens_for(Session, 'before_flush')
+def track_user_changes(db_session, flush_context, instances):
+    changed = {user.id for user in (*db_session.dirty, *db_session.deleted) if isinstance(user, User)}
+    if changed:
+        db_session.info.setdefault('users_changed', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_on_user_commit(db_session):
+    """Drop cached identities once a profile or API key change has committed"""
+    identity_cache.invalidate(db_session.info.pop('users_changed', ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def reset_user_changes(db_session):
+    db_session.info.pop('users_changed', None)
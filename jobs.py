@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, or_, and_
+from sqlalchemy.orm import Session
+
+from model import db, Job, User, create_and_store_api_key_for_user
+
+
+class JobQueue:
+    """Persistent queue in the jobs table, worked by a thread pool in each process
+
+    Jobs are added to the caller's transaction, so they commit (or roll back)
+    together with the rows that caused them. Workers claim a job with a
+    conditional UPDATE, which keeps several processes sharing the table from
+    running it twice.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.handlers = {}
+        self.workers = 0
+        self.pid = None
+        self.executor = None
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['JOBS_WORKERS']
+        self.poll_interval = app.config['JOBS_POLL_INTERVAL']
+        self.max_attempts = app.config['JOBS_MAX_ATTEMPTS']
+        self.stale_after = timedelta(seconds=app.config['JOBS_STALE_AFTER'])
+        self.retention = timedelta(seconds=app.config['JOBS_RETENTION'])
+        app.extensions['job_queue'] = self
+        if self.workers:
+            # Threads do not survive a fork, so each worker process starts its own
+            app.before_request(self.start)
+
+    def handler(self, name):
+        """Register the function run for jobs called name"""
+        def decorator(func):
+            self.handlers[name] = func
+            return func
+        return decorator
+
+    def enqueue(self, name, **payload):
+        """Add a job to the current transaction; workers see it once that commits"""
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job: {name}")
+        db.session.add(Job(name=name, payload=json.dumps(payload), max_attempts=self.max_attempts))
+        db.session.info['jobs_queued'] = True
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+            threading.Thread(target=self.dispatch, name='job-dispatcher', daemon=True).start()
+            self.pid = os.getpid()
+
+    def dispatch(self):
+        while True:
+            self.wakeup.clear()
+            with self.app.app_context():
+                try:
+                    if self.run_pending(self.executor):
+                        self.purge()
+                except Exception:
+                    self.app.logger.exception("Job dispatch failed")
+            self.wakeup.wait(self.poll_interval)
+
+    def runnable(self, now):
+        return or_(
+            and_(Job.status == 'queued', Job.run_after <= now),
+            and_(Job.status == 'running', Job.started_at < now - self.stale_after),
+        )
+
+    def claim(self, limit):
+        """Mark up to limit due jobs as running in this process and return their ids
+
+        One UPDATE both picks and claims the jobs, so SQLite takes the write
+        lock up front instead of upgrading a read, and the repeated condition
+        makes a concurrent claimer skip rows another process just took. An idle
+        poll only reads.
+        """
+        now = datetime.now(timezone.utc)
+        due = db.select(Job.id).where(self.runnable(now)).order_by(Job.id).limit(limit)
+        idle = db.session.execute(due).first() is None
+        db.session.commit()
+        if idle:
+            return []
+        job_ids = db.session.execute(
+            db.update(Job).where(Job.id.in_(due.scalar_subquery()), self.runnable(now))
+            .values(status='running', started_at=now, attempts=Job.attempts + 1)
+            .returning(Job.id)
+        ).scalars().all()
+        db.session.commit()
+        return sorted(job_ids)
+
+    def run_pending(self, executor=None):
+        """Run due jobs until none are left, on executor or in this thread; returns the count"""
+        batch_size = self.workers or 1
+        count = 0
+        while True:
+            job_ids = self.claim(batch_size)
+            if executor is None:
+                for job_id in job_ids:
+                    self.run(job_id)
+            else:
+                list(executor.map(self.run, job_ids))
+            count += len(job_ids)
+            if len(job_ids) < batch_size:
+                return count
+
+    def run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            try:
+                self.handlers[job.name](**json.loads(job.payload))
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.exception("Job %s (%s) failed", job_id, job.name)
+                job = db.session.get(Job, job_id)
+                job.error = f"{type(e).__name__}: {e}"
+                if job.attempts >= job.max_attempts:
+                    job.status = 'failed'
+                    job.finished_at = datetime.now(timezone.utc)
+                else:
+                    job.status = 'queued'
+                    job.run_after = datetime.now(timezone.utc) + timedelta(seconds=2 ** job.attempts)
+            else:
+                job.status = 'done'
+                job.error = None
+                job.finished_at = datetime.now(timezone.utc)
+            db.session.commit()
+
+    def purge(self):
+        """Delete finished jobs older than JOBS_RETENTION; failed ones are kept for inspection"""
+        cutoff = datetime.now(timezone.utc) - self.retention
+        db.session.execute(db.delete(Job).where(Job.status == 'done', Job.finished_at < cutoff))
+        db.session.commit()
+
+
+job_queue = JobQueue()
+
+
+@job_queue.handler('issue_api_key')
+def issue_api_key(user_id):
+    """Give a newly registered user their first API key"""
+    user = db.session.get(User, user_id)
+    if user is not None and not user.api_key_hash:
+        create_and_store_api_key_for_user(user)
+
+
+@event.listens_for(Session, 'after_commit')
+def wake_on_job_commit(db_session):
+    """Start queued jobs right away instead of at the next poll"""
+    if db_session.info.pop('jobs_queued', False):
+        job_queue.wakeup.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def reset_queued_jobs(db_session):
+    db_session.info.pop('jobs_queued', None)
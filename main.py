@@ -1,24 +1,19 @@
-from flask import Flask
-from routes.api_routes import api_bp
-from routes.normal_routes import normal_bp
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+import click
+from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager
-from model import db, User
+from model import (db, User, backfill_api_key_hashes, backfill_cafe_coordinates, backfill_cafe_changes,
+                   ensure_cafes_version, ensure_indexes, apply_sqlite_pragmas)
 from config import config
+from identity import identity_cache
+from bulk import parse_records, import_cafes, is_map_url_conflict
+from export import EXPORT_FORMATS, ExportStats, export_query, iter_export, gzip_chunks
 import os
+import time
 
 login_manager = LoginManager()
-app = Flask(__name__)
-
-# Load configuration
-config_name = os.environ.get('FLASK_ENV', 'development')
-app.config.from_object(config[config_name])
-
-app.register_blueprint(api_bp, url_prefix='/v1')
-app.register_blueprint(normal_bp)
-
-db.init_app(app)
-login_manager.init_app(app)
-
 login_manager.login_view = 'normal.login'
 login_manager.login_message = "Giriş yapmalısınız!"
 login_manager.login_message_category = 'info'
@@ -26,12 +21,155 @@ login_manager.session_protection = 'strong'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity_cache.load(int(user_id))
+
+def create_app(config_name=None):
+    """Build the Flask app for config_name (default: FLASK_ENV)
+
+    Startup does no database round trips: the schema is created by the
+    init-db command, run once per deploy.
+    """
+    from routes.api_routes import api_bp
+    from routes.normal_routes import normal_bp
+    from cache import response_cache
+    from metrics import metrics
+    from ratelimit import rate_limiter
+    from replica import init_replica
+    from jobs import job_queue
+
+    app = Flask(__name__)
+    app.config.from_object(config[config_name or os.environ.get('FLASK_ENV', 'development')])
+    if app.config['TRUSTED_PROXY_COUNT']:
+        proxies = app.config['TRUSTED_PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    app.register_blueprint(api_bp, url_prefix='/v1')
+    app.register_blueprint(normal_bp)
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    response_cache.init_app(app)
+    metrics.init_app(app, db)
+    rate_limiter.init_app(app)
+    identity_cache.init_app(app)
+    job_queue.init_app(app)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'])
+    init_replica(app, db)
 
-with app.app_context():
+    for command in (init_db_command, backfill_api_key_hashes_command, backfill_cafe_coordinates_command,
+                    backfill_cafe_changes_command, import_cafes_command, export_cafes_command,
+                    run_jobs_command):
+        app.cli.add_command(command)
+    return app
+
+def init_db():
+    """Create missing tables and indexes, the search index and the cache version row"""
+    from search import init_search
     db.create_all()
+    ensure_indexes()
+    init_search()
+    ensure_cafes_version()
+
+def dispose_engines(app):
+    """Drop pooled connections inherited from a parent process after fork"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database schema and search index"""
+    init_db()
+    print("Database initialized")
+
+@click.command('backfill-api-key-hashes')
+@with_appcontext
+def backfill_api_key_hashes_command():
+    """Add and populate api_key_hash for users created before it existed"""
+    count = backfill_api_key_hashes()
+    print(f"Backfilled API key hashes for {count} users")
+
+@click.command('backfill-cafe-coordinates')
+@with_appcontext
+def backfill_cafe_coordinates_command():
+    """Add latitude, longitude and geohash columns and derive them from map_url"""
+    count = backfill_cafe_coordinates()
+    print(f"Located {count} cafes from their map URLs")
+
+@click.command('backfill-cafe-changes')
+@with_appcontext
+def backfill_cafe_changes_command():
+    """Add updated_at and the change log, and log every cafe not yet in GET /v1/cafes/changes"""
+    count = backfill_cafe_changes()
+    print(f"Logged {count} existing cafes in the change feed")
+
+@click.command('import-cafes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--username', required=True, help='Owner of the imported cafes')
+@click.option('--format', 'fmt', type=click.Choice(['json', 'ndjson', 'csv']),
+              help='File format (default: from the file extension)')
+@click.option('--chunk-size', type=int, help='Rows per INSERT batch')
+@with_appcontext
+def import_cafes_command(path, username, fmt, chunk_size):
+    """Import cafes from a JSON, NDJSON or CSV file"""
+    user = db.session.execute(db.select(User).filter_by(username=username)).scalar()
+    if not user:
+        raise click.ClickException(f"User {username} does not exist")
+    with open(path, 'rb') as f:
+        records = parse_records(f.read(), fmt or path.rsplit('.', 1)[-1].lower())
+    try:
+        results = import_cafes(records, user.id, chunk_size or current_app.config['BULK_IMPORT_CHUNK_SIZE'])
+    except IntegrityError as e:
+        db.session.rollback()
+        if not is_map_url_conflict(e):
+            raise
+        raise click.ClickException("Cafes were added concurrently, nothing was imported; run the import again")
+    for result in results:
+        if result["status"] == "error":
+            print(f"Row {result['index']}: {result['error']}")
+    created = sum(1 for result in results if result["status"] == "created")
+    print(f"Imported {created} of {len(results)} cafes")
+
+@click.command('export-cafes')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output')
+@click.option('--country', help='Only export cafes in this country')
+@click.option('--since', type=click.DateTime(), help='Only cafes created at or after this time')
+@click.option('--until', type=click.DateTime(), help='Only cafes created before this time')
+@with_appcontext
+def export_cafes_command(path, fmt, compress, country, since, until):
+    """Export the cafe catalogue to CSV or columnar JSON batches"""
+    stats = ExportStats()
+    chunks = iter_export(export_query(country, since, until), fmt,
+                         current_app.config['CAFES_STREAM_BATCH_SIZE'], stats)
+    with open(path, 'wb') as f:
+        for chunk in gzip_chunks(chunks) if compress else chunks:
+            f.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+    print(f"Exported {stats.rows} cafes in {stats.seconds:.2f}s ({stats.rows_per_second:.0f} rows/sec)")
+
+@click.command('run-jobs')
+@click.option('--forever', is_flag=True, help='Keep polling for new jobs instead of exiting')
+@with_appcontext
+def run_jobs_command(forever):
+    """Run queued background jobs in this process"""
+    from jobs import job_queue
+    count = job_queue.run_pending()
+    print(f"Ran {count} jobs")
+    while forever:
+        time.sleep(current_app.config['JOBS_POLL_INTERVAL'])
+        if job_queue.run_pending():
+            job_queue.purge()
 
 
 if '__main__' == __name__:
+    app = create_app()
+    # The development server is a single process, so set the schema up here too
+    with app.app_context():
+        init_db()
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=app.config['DEBUG'])
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=app.config['DEBUG'])
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Checked by record_timing so disabled instrumentation costs one attribute lookup
+enabled = False
+
+
+class EndpointStats:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.decrypts = 0
+        self.decrypt_seconds = 0.0
+        self.response_bytes = 0
+
+    def observe(self, latency, sql_statements, sql_seconds, decrypts, decrypt_seconds, response_bytes):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[index] += 1
+        self.count += 1
+        self.latency_sum += latency
+        self.sql_statements += sql_statements
+        self.sql_seconds += sql_seconds
+        self.decrypts += decrypts
+        self.decrypt_seconds += decrypt_seconds
+        self.response_bytes += response_bytes
+
+
+@contextmanager
+def record_timing(name):
+    """Count and time a block (e.g. 'decrypt') against the current request"""
+    if not enabled or not has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(g, f'metrics_{name}_count', getattr(g, f'metrics_{name}_count', 0) + 1)
+        setattr(g, f'metrics_{name}_seconds',
+                getattr(g, f'metrics_{name}_seconds', 0.0) + time.perf_counter() - start)
+
+
+class Metrics:
+    """Per-endpoint request, SQL, Fernet and response size metrics for this process"""
+
+    def __init__(self):
+        self.stats = defaultdict(EndpointStats)
+        self.lock = threading.Lock()
+        self.server_timing = False
+
+    def init_app(self, app, db):
+        global enabled
+        if not app.config['METRICS_ENABLED']:
+            return
+        enabled = True
+        self.server_timing = app.config['SERVER_TIMING_ENABLED']
+        app.extensions['metrics'] = self
+
+        # Every bind, so reads served by the replica are counted too
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+        if has_request_context():
+            g.metrics_sql_count = g.get('metrics_sql_count', 0) + 1
+            g.metrics_sql_seconds = g.get('metrics_sql_seconds', 0.0) + elapsed
+
+    def before_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def after_request(self, response):
+        start = g.get('metrics_start')
+        if start is None or request.endpoint == 'metrics':
+            return response
+        latency = time.perf_counter() - start
+        sql_count = g.get('metrics_sql_count', 0)
+        sql_seconds = g.get('metrics_sql_seconds', 0.0)
+        decrypts = g.get('metrics_decrypt_count', 0)
+        decrypt_seconds = g.get('metrics_decrypt_seconds', 0.0)
+        size = 0 if response.is_streamed else response.calculate_content_length() or 0
+
+        with self.lock:
+            self.stats[request.endpoint or 'unknown'].observe(
+                latency, sql_count, sql_seconds, decrypts, decrypt_seconds, size
+            )
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = (
+                f'app;dur={latency * 1000:.1f}, '
+                f'sql;desc="{sql_count} queries";dur={sql_seconds * 1000:.1f}, '
+                f'fernet;desc="{decrypts} decrypts";dur={decrypt_seconds * 1000:.1f}'
+            )
+        return response
+
+    def render(self):
+        """Prometheus text exposition of the collected metrics"""
+        with self.lock:
+            snapshot = sorted(self.stats.items())
+        lines = [
+            '# HELP cafe_request_duration_seconds Request latency by endpoint',
+            '# TYPE cafe_request_duration_seconds histogram',
+        ]
+        for endpoint, stats in snapshot:
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                lines.append(f'cafe_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'cafe_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {stats.count}')
+            lines.append(f'cafe_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats.latency_sum}')
+            lines.append(f'cafe_request_duration_seconds_count{{endpoint="{endpoint}"}} {stats.count}')
+
+        counters = [
+            ('cafe_sql_statements_total', 'SQL statements executed', 'sql_statements'),
+            ('cafe_sql_duration_seconds_total', 'Time spent executing SQL', 'sql_seconds'),
+            ('cafe_fernet_decrypt_total', 'Fernet API key decryptions', 'decrypts'),
+            ('cafe_fernet_decrypt_seconds_total', 'Time spent in Fernet decryption', 'decrypt_seconds'),
+            ('cafe_response_bytes_total', 'Response body bytes (non-streamed)', 'response_bytes'),
+        ]
+        for name, help_text, attribute in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for endpoint, stats in snapshot:
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(stats, attribute)}')
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
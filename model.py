@@ -1,16 +1,27 @@
-from sqlalchemy import Integer, String, Boolean, Numeric, func, DateTime, ForeignKey
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import Integer, String, Boolean, Numeric, Float, Text, func, DateTime, ForeignKey, Index
+from sqlalchemy import event
+from sqlalchemy.orm import Mapped, mapped_column, relationship, undefer, Session
+from sqlalchemy.exc import IntegrityError
 from flask_login import UserMixin
 from datetime import datetime, timezone
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+from operator import attrgetter
 import os
+import hmac
+import hashlib
 import secrets
 from cryptography.fernet import Fernet, InvalidToken
 from flask_sqlalchemy import SQLAlchemy
+from metrics import record_timing
+from replica import RoutingSession
+from geo import map_url_location
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 from flask import current_app
 
+API_KEY_MAX_ATTEMPTS = 5
+
 
 def get_fernet():
     """Get Fernet instance with key from config"""
@@ -19,8 +30,38 @@ def get_fernet():
         raise RuntimeError("FERNET_KEY not configured")
     return Fernet(fernet_key.encode())
 
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run PRAGMA statements on every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def get_api_key_hash_secret():
+    """Get the HMAC secret used to fingerprint API keys"""
+    secret = current_app.config.get('API_KEY_HASH_SECRET') or current_app.config.get('FERNET_KEY')
+    if not secret:
+        raise RuntimeError("API_KEY_HASH_SECRET not configured")
+    return secret.encode()
+
 class Cafe(db.Model):
     __tablename__ = 'cafes'
+    __table_args__ = (
+        db.Index('ix_cafes_name_id', 'name', 'id'),
+        db.Index('ix_cafes_country_location_price', 'country', 'location', 'coffee_price'),
+        db.Index('ix_cafes_coffee_price', 'coffee_price'),
+        db.Index('ix_cafes_location', 'location'),
+        db.Index('ix_cafes_amenities', 'has_wifi', 'has_sockets', 'has_toilet', 'can_take_calls'),
+        db.Index('ix_cafes_geohash', 'geohash'),
+    )
+    # created_at / updated_at come back through RETURNING on INSERT and UPDATE,
+    # so views can serialize a cafe after flush without another SELECT
+    __mapper_args__ = {'eager_defaults': True}
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(250), nullable=False)
     map_url: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
@@ -33,29 +74,250 @@ class Cafe(db.Model):
     can_take_calls: Mapped[bool] = mapped_column(Boolean, nullable=False)
     coffee_price: Mapped[Decimal] = mapped_column(Numeric(10, 2), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    # default as well as server_default: upgraded databases add the column without a DEFAULT
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(),
+                                                 server_default=func.now(), onupdate=func.now())
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    # Derived from map_url whenever it is set; see geo.map_url_location
+    latitude: Mapped[float] = mapped_column(Float, nullable=True)
+    longitude: Mapped[float] = mapped_column(Float, nullable=True)
+    geohash: Mapped[str] = mapped_column(String(12), nullable=True)
 
-    user = relationship("User", back_populates="cafes")
+    # Lazy loads raise: select the columns needed, or load with joinedload(Cafe.user)
+    user = relationship("User", back_populates="cafes", lazy='raise_on_sql')
 
     def to_dict(self):
-        dictionary = {}
-        for column in self.__table__.columns:
-            dictionary[column.name] = getattr(self, column.name)
-        return dictionary
+        return CAFE_SERIALIZER.from_object(self)
+
+@event.listens_for(Cafe.map_url, 'set')
+def locate_cafe(cafe, map_url, old_value, initiator):
+    """Keep latitude, longitude and geohash in step with map_url"""
+    for name, value in map_url_location(map_url).items():
+        setattr(cafe, name, value)
+
+@event.listens_for(Cafe.coffee_price, 'set', retval=True)
+def round_coffee_price(cafe, price, old_value, initiator):
+    """Round to the column's scale on assignment, so a cafe serialized after flush shows the stored price"""
+    return quantize_price(price)
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     username: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
     email: Mapped[str] = mapped_column(String(250), unique=True, nullable=False)
-    password: Mapped[str] = mapped_column(String(100))
+    # Only needed at login and on the user panel, so loaded on first access
+    password: Mapped[str] = mapped_column(String(100), deferred=True)
 
-    api_key_enc: Mapped[str] = mapped_column(String(500), nullable=True)
+    api_key_enc: Mapped[str] = mapped_column(String(500), nullable=True, deferred=True)
     api_key_last4: Mapped[str] = mapped_column(String(10), nullable=True)
+    api_key_hash: Mapped[str] = mapped_column(String(64), unique=True, index=True, nullable=True)
     api_key_created_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
     api_key_active: Mapped[bool] = mapped_column(Boolean, default=False)
 
-    cafes = relationship("Cafe", back_populates="user")
+    # Lazy loads raise: query Cafe by user_id, or load with selectinload(User.cafes)
+    cafes = relationship("Cafe", back_populates="user", lazy='raise_on_sql')
+
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class CafeChange(db.Model):
+    """Append-only log of Cafe inserts, updates and deletes, read by GET /v1/cafes/changes"""
+    __tablename__ = 'cafe_changes'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Not a foreign key: delete entries outlive the cafe
+    cafe_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    op: Mapped[str] = mapped_column(String(10), nullable=False)
+    changed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class Job(db.Model):
+    """Background job queued by a request and run by jobs.JobQueue"""
+    __tablename__ = 'jobs'
+    __table_args__ = (Index('ix_jobs_status_run_after', 'status', 'run_after'),)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False, default='{}')
+    # queued -> running -> done, or back to queued until max_attempts, then failed
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default='queued')
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=3)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+    run_after: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False,
+                                                default=lambda: datetime.now(timezone.utc))
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+CAFES_VERSION = 'cafes'
+
+def ensure_cafes_version():
+    """Create the version row for the cafe catalogue if it does not exist yet"""
+    if not db.session.get(CacheVersion, CAFES_VERSION):
+        db.session.add(CacheVersion(name=CAFES_VERSION, version=0, updated_at=datetime.now(timezone.utc)))
+        db.session.commit()
+
+def cafes_version_query():
+    return db.select(CacheVersion.version, CacheVersion.updated_at).filter_by(name=CAFES_VERSION)
+
+def get_cafes_version():
+    """Return (version, updated_at) of the cafe catalogue"""
+    return normalize_version(db.session.execute(cafes_version_query()).first())
+
+def normalize_version(row):
+    if not row:
+        return 0, None
+    version, updated_at = row
+    if updated_at is not None and updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return version, updated_at
+
+def bump_cafes_version(session):
+    session.execute(
+        db.update(CacheVersion)
+        .where(CacheVersion.name == CAFES_VERSION)
+        .values(version=CacheVersion.version + 1, updated_at=datetime.now(timezone.utc))
+    )
+
+def mark_cafes_changed(session):
+    """Record a Cafe write in this transaction; bulk statements that bypass flush call this directly"""
+    bump_cafes_version(session)
+    session.info['cafes_changed'] = True
+
+@event.listens_for(Session, 'before_flush')
+def bump_version_on_cafe_write(session, flush_context, instances):
+    """Any Cafe insert, update or delete invalidates cached catalogue responses"""
+    changed = (session.new, session.dirty, session.deleted)
+    if any(isinstance(obj, Cafe) for objects in changed for obj in objects):
+        mark_cafes_changed(session)
+
+def log_cafe_changes(session, op, cafe_ids):
+    """Append op ('insert', 'update' or 'delete') entries for cafe_ids to the change log
+
+    Call after mark_cafes_changed: the version row it updates stays locked
+    until commit, so change ids are handed out in commit order and a feed
+    reader never skips an entry that commits late.
+    """
+    if cafe_ids:
+        session.execute(db.insert(CafeChange.__table__), [{'cafe_id': cafe_id, 'op': op} for cafe_id in cafe_ids])
+
+@event.listens_for(Session, 'after_flush')
+def log_cafe_writes(session, flush_context):
+    """Record flushed Cafe writes; bulk statements that bypass flush call log_cafe_changes directly"""
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        log_cafe_changes(session, op, [
+            obj.id for obj in objects
+            if isinstance(obj, Cafe) and (op != 'update' or session.is_modified(obj))
+        ])
+
+
+def find_user_conflicts(username, email):
+    """Return which of 'username' / 'email' are already registered, in one query"""
+    rows = db.session.execute(
+        db.select(User.username, User.email).where(db.or_(User.username == username, User.email == email))
+    ).all()
+    conflicts = set()
+    for taken_username, taken_email in rows:
+        if taken_username == username:
+            conflicts.add('username')
+        if taken_email == email:
+            conflicts.add('email')
+    return conflicts
+
+def map_url_owner(map_url):
+    """Id of the cafe using map_url, or None"""
+    return db.session.execute(db.select(Cafe.id).filter_by(map_url=map_url)).scalar()
+
+
+def cafe_counts_query(column, country=None):
+    count = func.count(Cafe.id).label('count')
+    query = db.select(column, count, func.avg(Cafe.coffee_price).label('avg_price'))
+    if country:
+        query = query.where(Cafe.country == country)
+    return query.group_by(column).order_by(count.desc(), column)
+
+def cafe_counts_by(column, country=None):
+    """Return (value, cafe_count, avg_coffee_price) rows grouped by a Cafe column, most cafes first"""
+    return db.session.execute(cafe_counts_query(column, country)).all()
+
+
+class RowSerializer:
+    """Column names and JSON converters resolved once, reused for every row"""
+
+    def __init__(self, columns):
+        columns = list(columns)
+        self.names = tuple(column.name for column in columns)
+        self.converters = tuple(
+            (column.name, converter)
+            for column in columns
+            if (converter := json_converter(column.type)) is not None
+        )
+        getter = attrgetter(*self.names)
+        self.getter = getter if len(self.names) > 1 else (lambda obj: (getter(obj),))
+
+    def from_row(self, row):
+        """Serialize a Row or tuple whose values are in self.names order"""
+        values = dict(zip(self.names, row))
+        for name, convert in self.converters:
+            value = values[name]
+            if value is not None:
+                values[name] = convert(value)
+        return values
+
+    def from_object(self, obj):
+        return self.from_row(self.getter(obj))
+
+
+PRICE_EXPONENT = Decimal(1).scaleb(-Cafe.__table__.c.coffee_price.type.scale)
+
+def quantize_price(price):
+    """price as a Decimal rounded half up to the coffee_price scale; values that are not numbers are returned as is"""
+    if isinstance(price, bool):
+        return price
+    try:
+        return Decimal(str(price)).quantize(PRICE_EXPONENT, rounding=ROUND_HALF_UP)
+    except (InvalidOperation, ValueError):
+        return price
+
+def numeric_to_str(scale):
+    """Decimals loaded from the database pass through str; raw client input is quantized to the column scale"""
+    exponent = Decimal(1).scaleb(-scale) if scale is not None else None
+
+    def convert(value):
+        if isinstance(value, Decimal) or exponent is None:
+            return str(value)
+        return str(Decimal(str(value)).quantize(exponent))
+    return convert
+
+HTTP_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+HTTP_MONTHS = (None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+def datetime_to_http_date(value):
+    """Same string as werkzeug's http_date (naive values are UTC), in half the time"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return (f"{HTTP_DAYS[value.weekday()]}, {value.day:02d} {HTTP_MONTHS[value.month]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+def json_converter(column_type):
+    """Match Flask's JSON encoding for types it would otherwise convert per value"""
+    if isinstance(column_type, Numeric):
+        return numeric_to_str(column_type.scale)
+    if isinstance(column_type, DateTime):
+        return datetime_to_http_date
+    return None
+
+CAFE_SERIALIZER = RowSerializer(Cafe.__table__.columns)
+
+@lru_cache(maxsize=128)
+def get_cafe_serializer(names):
+    """Serializer for a projection of Cafe columns, cached per field tuple"""
+    return RowSerializer(Cafe.__table__.c[name] for name in names)
 
 
 def generate_raw_api_key():
@@ -68,34 +330,145 @@ def encrypt_key(raw_key: str) -> str:
 def decrypt_key(stored: str) -> str:
     fernet = get_fernet()
     try:
-        return fernet.decrypt(stored.encode()).decode()
+        with record_timing('decrypt'):
+            return fernet.decrypt(stored.encode()).decode()
     except InvalidToken:
         raise RuntimeError("Stored API key could not be decrypted")
 
-def create_and_store_api_key_for_user(user: User) -> str:
-    while True:
+def hash_key(raw_key: str) -> str:
+    """HMAC-SHA256 fingerprint of a raw API key, used for indexed lookups"""
+    return hmac.new(get_api_key_hash_secret(), raw_key.encode(), hashlib.sha256).hexdigest()
+
+def get_user_by_api_key(raw_key: str):
+    """Resolve a raw API key to its active User with a single indexed query"""
+    return db.session.execute(
+        db.select(User).filter_by(api_key_hash=hash_key(raw_key), api_key_active=True)
+    ).scalar()
+
+def assign_api_key(user: User) -> str:
+    """Set a new API key on user within the current transaction, without committing
+
+    Each attempt flushes in a savepoint so the unique api_key_hash index
+    rejects collisions without losing the rest of the transaction.
+    """
+    for _ in range(API_KEY_MAX_ATTEMPTS):
         raw = generate_raw_api_key()
-        last4 = raw[-4:]
-        candidates = db.session.execute(
-            db.select(User).filter_by(api_key_last4=last4, api_key_active=True)
-        ).scalars().all()
-
-        conflict = False
-        for c in candidates:
-            try:
-                if decrypt_key(c.api_key_enc) == raw:
-                    conflict = True
-                    break
-            except Exception:
-                continue
-        if not conflict:
-            break
-
-    enc = encrypt_key(raw)
-    user.api_key_enc = enc
-    user.api_key_last4 = raw[-4:]
-    user.api_key_created_at = datetime.now(timezone.utc)
-    user.api_key_active = True
-    db.session.add(user)
+        try:
+            with db.session.begin_nested():
+                user.api_key_enc = encrypt_key(raw)
+                user.api_key_last4 = raw[-4:]
+                user.api_key_hash = hash_key(raw)
+                user.api_key_created_at = datetime.now(timezone.utc)
+                user.api_key_active = True
+                db.session.add(user)
+        except IntegrityError:
+            continue
+        return raw
+    raise RuntimeError("Could not generate a unique API key")
+
+def create_and_store_api_key_for_user(user: User) -> str:
+    """Issue a new API key and commit it"""
+    raw = assign_api_key(user)
+    db.session.commit()
+    return raw
+
+
+def ensure_indexes() -> list:
+    """Create model indexes missing from tables that existed before the index was added
+
+    create_all() only indexes the tables it creates. Indexes on columns a
+    backfill command has not added yet are skipped; that command creates them.
+    """
+    inspector = db.inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing and {column.name for column in index.columns} <= columns:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
+
+def backfill_api_key_hashes() -> int:
+    """Add the api_key_hash column if missing and fill it for existing users"""
+    inspector = db.inspect(db.engine)
+    columns = [column['name'] for column in inspector.get_columns(User.__tablename__)]
+    if 'api_key_hash' not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE users ADD COLUMN api_key_hash VARCHAR(64)"))
+            conn.execute(db.text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_api_key_hash ON users (api_key_hash)"
+            ))
+
+    users = db.session.execute(
+        db.select(User).filter(User.api_key_enc.is_not(None), User.api_key_hash.is_(None))
+        .options(undefer(User.api_key_enc))
+    ).scalars().all()
+    for user in users:
+        user.api_key_hash = hash_key(decrypt_key(user.api_key_enc))
+    db.session.commit()
+    return len(users)
+
+# Cafe columns added after the first release; each backfill adds all of them,
+# so the backfills can run in any order (ORM updates also write updated_at)
+ADDED_CAFE_COLUMNS = ('latitude', 'longitude', 'geohash', 'updated_at')
+
+def add_cafe_columns(conn) -> list:
+    """ALTER TABLE in the ADDED_CAFE_COLUMNS an older cafes table lacks; returns their names"""
+    existing = {column['name'] for column in db.inspect(conn).get_columns(Cafe.__tablename__)}
+    added = []
+    for name in ADDED_CAFE_COLUMNS:
+        if name not in existing:
+            sql_type = Cafe.__table__.c[name].type.compile(dialect=conn.dialect)
+            conn.execute(db.text(f"ALTER TABLE cafes ADD COLUMN {name} {sql_type}"))
+            added.append(name)
+    if 'updated_at' in added:
+        conn.execute(db.text("UPDATE cafes SET updated_at = created_at"))
+    return added
+
+def backfill_cafe_coordinates(batch_size=1000) -> int:
+    """Add the coordinate columns if missing and derive them from map_url for existing cafes"""
+    with db.engine.begin() as conn:
+        add_cafe_columns(conn)
+        conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_cafes_geohash ON cafes (geohash)"))
+
+    rows = db.session.execute(
+        db.select(Cafe.id, Cafe.map_url).where(Cafe.geohash.is_(None)).execution_options(yield_per=batch_size)
+    )
+    updates = []
+    for cafe_id, map_url in rows:
+        location = map_url_location(map_url)
+        if location['geohash']:
+            updates.append(dict(location, id=cafe_id))
+    for start in range(0, len(updates), batch_size):
+        db.session.execute(db.update(Cafe), updates[start:start + batch_size])
+    if updates:
+        mark_cafes_changed(db.session)
+        log_cafe_changes(db.session, 'update', [values['id'] for values in updates])
+    db.session.commit()
+    return len(updates)
+
+def backfill_cafe_changes() -> int:
+    """Add Cafe.updated_at and the change log if missing, and log every cafe the log has no entry for
+
+    Afterwards a feed read from since=0 returns the whole catalogue, even
+    when other backfills have already logged some cafes.
+    """
+    with db.engine.begin() as conn:
+        add_cafe_columns(conn)
+    CafeChange.__table__.create(db.engine, checkfirst=True)
+
+    count = db.session.execute(
+        db.insert(CafeChange.__table__).from_select(
+            ['cafe_id', 'op'],
+            db.select(Cafe.id, db.literal('insert'))
+            .where(Cafe.id.not_in(db.select(CafeChange.cafe_id))).order_by(Cafe.id)
+        )
+    ).rowcount
+    if count:
+        mark_cafes_changed(db.session)
     db.session.commit()
-    return raw
\ No newline at end of file
+    return count
@@ -0,0 +1,243 @@
+import math
+import re
+import threading
+import time
+
+from flask import request, g, jsonify
+
+from cache import load_backend
+from model import get_user_by_api_key
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rate(value):
+    """Parse '120/minute' or '10/5 seconds' into (requests, window_seconds)"""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*', value)
+    if not match:
+        raise ValueError(f"Invalid rate limit {value!r}")
+    count, multiplier, period = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[period]
+
+
+class RateLimitState:
+    """Outcome of counting one request against a limit"""
+
+    def __init__(self, allowed, limit, window, remaining, reset_after):
+        self.allowed = allowed
+        self.limit = limit
+        self.window = window
+        self.remaining = max(0, remaining)
+        self.reset_after = max(0, reset_after)
+
+    @property
+    def retry_after(self):
+        return max(1, math.ceil(self.reset_after))
+
+
+class RateLimitBackend:
+    """Interface for rate limit counter stores"""
+
+    def hit(self, key, limit, window):
+        """Count one request for key and return its RateLimitState"""
+        raise NotImplementedError
+
+    def peek(self, key, limit, window):
+        """Return the RateLimitState for key without counting a request"""
+        raise NotImplementedError
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """In-process token buckets refilling limit tokens per window, for one worker"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, limit, window, cost):
+        now = time.monotonic()
+        rate = limit / window
+        with self.lock:
+            entry = self.buckets.pop(key, None)
+            tokens, updated = entry or (limit, now)
+            tokens = min(limit, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            if entry or cost:
+                self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_entries:
+                del self.buckets[next(iter(self.buckets))]
+        reset_after = (1 - tokens) / rate if not allowed else (limit - tokens) / rate
+        return RateLimitState(allowed, limit, window, int(tokens), reset_after)
+
+    def hit(self, key, limit, window):
+        return self.take(key, limit, window, 1)
+
+    def peek(self, key, limit, window):
+        return self.take(key, limit, window, 0)
+
+
+class SharedRateLimitBackend(RateLimitBackend):
+    """Sliding window counters for stores shared between workers (Redis, memcached, ...)
+
+    Implementations only provide incr and get_many; the current and
+    previous fixed windows are combined into a sliding estimate here.
+    """
+
+    def incr(self, key, ttl):
+        """Atomically add one to key, expiring it after ttl seconds, and return the new value"""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Return the current values for keys, 0 for missing ones"""
+        raise NotImplementedError
+
+    def state(self, key, limit, window, count):
+        now = time.time()
+        start = now // window * window
+        previous, current = self.get_many([f"{key}:{int(start - window)}", f"{key}:{int(start)}"])
+        weight = 1 - (now - start) / window
+        used = previous * weight + current
+        allowed = used + count <= limit
+        if allowed and count:
+            current = self.incr(f"{key}:{int(start)}", window * 2)
+            used = previous * weight + current
+        if allowed or current + 1 > limit or not previous:
+            reset_after = start + window - now
+        else:
+            # Wait until the previous window's share has decayed enough
+            reset_after = window * (1 - (limit - current - 1) / previous) - (now - start)
+        return RateLimitState(allowed, limit, window, int(limit - used), reset_after)
+
+    def hit(self, key, limit, window):
+        return self.state(key, limit, window, 1)
+
+    def peek(self, key, limit, window):
+        return self.state(key, limit, window, 0)
+
+
+class LocalSharedRateLimitBackend(SharedRateLimitBackend):
+    """In-memory stand-in for a shared store, for local runs and tests"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.store = {}
+        self.lock = threading.Lock()
+
+    def incr(self, key, ttl):
+        with self.lock:
+            value, expires_at = self.store.get(key, (0, time.time() + ttl))
+            if expires_at <= time.time():
+                value, expires_at = 0, time.time() + ttl
+            self.store[key] = (value + 1, expires_at)
+            while len(self.store) > self.max_entries:
+                del self.store[next(iter(self.store))]
+            return value + 1
+
+    def get_many(self, keys):
+        now = time.time()
+        with self.lock:
+            entries = [self.store.get(key) for key in keys]
+        return [entry[0] if entry and entry[1] > now else 0 for entry in entries]
+
+
+BACKENDS = {
+    'memory': 'ratelimit.MemoryRateLimitBackend',
+    'local-shared': 'ratelimit.LocalSharedRateLimitBackend',
+}
+
+
+def client_identity(api_key_hash, remote_addr):
+    """Rate limit key for a request: the fingerprint of a verified API key, or the client IP
+
+    Only pass the hash of a key that belongs to an active user; unverified
+    keys would give every made-up key its own fresh bucket.
+    """
+    return f"key:{api_key_hash}" if api_key_hash else f"ip:{remote_addr}"
+
+
+def forwarded_addr(remote_addr, forwarded_for, proxies):
+    """Client IP as ProxyFix(x_for=proxies) resolves it, for requests that do not go through Flask"""
+    if proxies and forwarded_for:
+        values = forwarded_for.split(',')
+        if len(values) >= proxies:
+            return values[-proxies].strip()
+    return remote_addr
+
+
+class RateLimiter:
+    """Per-route request limits and a daily quota for the /v1 API"""
+
+    def __init__(self):
+        self.backend = None
+        self.default_limit = None
+        self.route_limits = {}
+        self.daily_quota = 0
+
+    def init_app(self, app):
+        name = app.config['RATELIMIT_BACKEND']
+        if not name:
+            return
+        self.backend = load_backend(name, BACKENDS, app.config['RATELIMIT_MAX_ENTRIES'])
+        self.default_limit = parse_rate(app.config['RATELIMIT_DEFAULT'])
+        self.route_limits = {endpoint: parse_rate(value) for endpoint, value in app.config['RATELIMIT_ROUTES'].items()}
+        self.daily_quota = app.config['RATELIMIT_DAILY_QUOTA']
+        app.extensions['rate_limiter'] = self
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def limit_for(self, endpoint):
+        return self.route_limits.get(endpoint, self.default_limit)
+
+    def check(self, identity, endpoint):
+        """Count a request to endpoint; return (allowed, headers)"""
+        limit, window = self.limit_for(endpoint)
+        states = [self.backend.hit(f"{endpoint}:{identity}", limit, window)]
+        if self.daily_quota and identity.startswith('key:') and states[0].allowed:
+            states.append(self.backend.hit(f"quota:{identity}", self.daily_quota, PERIODS['day']))
+
+        denied = [state for state in states if not state.allowed]
+        state = denied[0] if denied else min(states, key=lambda state: state.remaining)
+        headers = {
+            'RateLimit-Policy': ', '.join(f"{state.limit};w={state.window}" for state in states),
+            'RateLimit-Limit': str(state.limit),
+            'RateLimit-Remaining': str(state.remaining),
+            'RateLimit-Reset': str(math.ceil(state.reset_after)),
+        }
+        if denied:
+            headers['Retry-After'] = str(state.retry_after)
+        return not denied, headers
+
+    def usage(self, api_key_hash):
+        """Daily quota and per-route limit state for a user's API key, without counting"""
+        identity = f"key:{api_key_hash}"
+        quota = self.backend.peek(f"quota:{identity}", self.daily_quota, PERIODS['day']) if self.daily_quota else None
+        routes = {
+            endpoint: self.backend.peek(f"{endpoint}:{identity}", limit, window)
+            for endpoint, (limit, window) in sorted(self.route_limits.items())
+        }
+        return quota, routes
+
+    def before_request(self):
+        if request.blueprint != 'api' or request.endpoint is None:
+            return None
+        api_key = request.headers.get('X-API-KEY')
+        user = get_user_by_api_key(api_key) if api_key else None
+        if user is not None:
+            # Reused by api_key_required instead of looking the key up again
+            g.api_user = user
+        identity = client_identity(user.api_key_hash if user is not None else None, request.remote_addr)
+        allowed, g.rate_limit_headers = self.check(identity, request.endpoint)
+        if not allowed:
+            return jsonify({"error": "Rate limit exceeded"}), 429
+        return None
+
+    def after_request(self, response):
+        for name, value in g.pop('rate_limit_headers', {}).items():
+            response.headers[name] = value
+        return response
+
+
+rate_limiter = RateLimiter()
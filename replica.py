@@ -0,0 +1,73 @@
+import sqlite3
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(FlaskSession):
+    """Sends reads from @use_replica views to the replica bind
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary,
+    and once a session has written, the rest of its reads stay on the
+    primary so a request sees its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and (self._flushing or isinstance(clause, UpdateBase)):
+            self.info['db_wrote'] = True
+        elif (
+            bind is None
+            and has_request_context()
+            and g.get('db_use_replica')
+            and not self.info.get('db_wrote')
+            and REPLICA_BIND in self._db.engines
+        ):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_replica(view):
+    """Mark a read-only view as safe to serve from the replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def sync_sqlite_replica(primary_engine, replica_engine):
+    """Copy the primary SQLite file over the replica with the online backup API"""
+    source = sqlite3.connect(primary_engine.url.database)
+    target = sqlite3.connect(replica_engine.url.database)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def init_replica(app, db):
+    """Enable the local stand-in replicator when REPLICA_SYNC is 'sqlite-backup'
+
+    Meant for development with two SQLite files: the replica starts as a
+    copy of the primary and every commit that wrote copies it again.
+    Real deployments leave REPLICA_SYNC unset and rely on database
+    replication.
+    """
+    if app.config['REPLICA_SYNC'] != 'sqlite-backup':
+        return
+    with app.app_context():
+        primary_engine = db.engines[None]
+        replica_engine = db.engines[REPLICA_BIND]
+    sync_sqlite_replica(primary_engine, replica_engine)
+
+    @event.listens_for(db.session, 'after_commit')
+    def replicate_after_commit(session):
+        if session.info.get('db_wrote'):
+            replica_engine.dispose()
+            sync_sqlite_replica(primary_engine, replica_engine)
@@ -1,9 +1,22 @@
 from dataclasses import field
+from decimal import Decimal
 
-from flask import request, jsonify, Blueprint
+from flask import request, jsonify, Blueprint, g, current_app, Response, stream_with_context
 from sqlalchemy.sql.functions import user
 from werkzeug.security import generate_password_hash
-from model import db, User, Cafe, create_and_store_api_key_for_user, decrypt_key
+from model import (db, User, Cafe, assign_api_key, get_cafe_serializer, cafe_counts_by,
+                   find_user_conflicts, map_url_owner, CAFE_SERIALIZER)
+from routes.auth import api_key_required
+from routes.listing import (parse_limit, parse_page, parse_fields, apply_cafe_filters, cafe_page, count_cafes,
+                            parse_coordinate, parse_radius, nearby_cafes, parse_since, cafe_changes)
+from search import search_cafes
+from http_cache import cached_by_cafes_version
+from cache import response_cache
+from replica import use_replica
+from bulk import parse_records, import_cafes, is_map_url_conflict
+from export import EXPORT_FORMATS, ExportStats, export_query, iter_export, gzip_chunks
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 
 
 api_bp = Blueprint('api', __name__)
@@ -23,11 +36,10 @@ def add_user():
         password = data['password']
         username = data['username']
         email = data['email']
-        check_user = db.session.execute(db.select(User).filter_by(username=username)).scalar()
-        check_email = db.session.execute(db.select(User).filter_by(email=email)).scalar()
-        if check_user:
+        conflicts = find_user_conflicts(username, email)
+        if 'username' in conflicts:
             return jsonify({"error":"Username already exists"}),400
-        if check_email:
+        if 'email' in conflicts:
             return jsonify({"error":"Email already exists"}),400
 
         password_hash = generate_password_hash(password)
@@ -37,12 +49,10 @@ def add_user():
             password=password_hash,
         )
         db.session.add(new_user)
+        db.session.flush()
+        # The key is part of the response, so it is issued here, in the same commit as the user
+        api_key = assign_api_key(new_user)
         db.session.commit()
-        create_and_store_api_key_for_user(new_user)
-        try:
-            api_key = decrypt_key(new_user.api_key_enc)
-        except Exception as e:
-            return jsonify({"error": "API key decryption failed"}), 500
 
         return jsonify({"success": True, "user": f"Username : {username} Password: {password}  API-KEY: {api_key}"}), 201
     except Exception as e:
@@ -50,58 +60,264 @@ def add_user():
 
 
 @api_bp.route('/users/<string:username>/info',methods=['GET'])
+@use_replica
+@api_key_required
 def user_info(username):
-    api_key = request.headers.get('X-API-KEY')
-    user = db.session.execute(db.select(User).filter_by(username=username)).scalar()
+    user = g.api_user
+    if user.username != username:
+        if not db.session.execute(db.select(User.id).filter_by(username=username)).scalar():
+            return jsonify({"error":"User not found"}), 404
+        return jsonify({"error": "API key does not match"}), 403
+    rows = db.session.execute(db.select(*Cafe.__table__.columns).filter_by(user_id=user.id))
+    return jsonify({"User": {"username": user.username,"email": user.email}, "Cafes":[CAFE_SERIALIZER.from_row(row) for row in rows]}), 200
 
-    if not user:
-        return jsonify({"error":"User not found"}), 404
-    if not api_key:
-        return jsonify({"error":"API key not found"}), 401
-    try:
-        decrypt_api_key = decrypt_key(user.api_key_enc)
-    except Exception as e:
-        return jsonify({"error": "API key decryption failed"}), 500
 
-    if api_key != decrypt_api_key:
-        return jsonify({"error": "API key does not match"}), 403
-    return jsonify({"User": {"username": user.username,"email": user.email}, "Cafes":[cafe.to_dict() for cafe in user.cafes]}), 200
 
+def stream_cafes(query, serializer, mode):
+    """Stream rows from a server-side cursor as NDJSON or a chunked JSON array"""
+    batch_size = current_app.config['CAFES_STREAM_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def generate():
+        rows = db.session.execute(query.execution_options(yield_per=batch_size))
+        if mode == 'ndjson':
+            for row in rows:
+                yield dumps(serializer.from_row(row)) + '\n'
+            return
+        yield '{"cafes": ['
+        first = True
+        for row in rows:
+            yield ('' if first else ',') + dumps(serializer.from_row(row))
+            first = False
+        yield ']}'
+
+    mimetype = 'application/x-ndjson' if mode == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 
 @api_bp.route('/cafes', methods=['GET'])
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_API')
+@response_cache.cached()
 def all_cafes_api():
-    result = db.session.execute(db.select(Cafe).order_by(Cafe.name))
-    all_cafes = result.scalars().all()
-    return jsonify(cafes=[cafe.to_dict() for cafe in all_cafes])
+    columns, unknown = parse_fields(request.args.get('fields'))
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {unknown}"}), 400
+    serializer = get_cafe_serializer(tuple(column.name for column in columns))
 
-@api_bp.route('/cafes/<string:username>', methods=['POST'])
-def add_cafe_api(username):
-    api_key = request.headers.get('X-API-KEY')
-    if not api_key:
-        return jsonify({"error": "API key not provided"}), 401
+    stream = request.args.get('stream')
+    if stream and stream not in ('ndjson', 'json'):
+        return jsonify({"error": "stream must be ndjson or json"}), 400
 
-    data = request.get_json()
-    user = db.session.execute(db.select(User).filter_by(username=username)).scalar()
-    if not user:
-        return jsonify({"error":"User does not exist"}), 404
+    if stream or request.args.get('all', '').lower() == 'true':
+        try:
+            query = apply_cafe_filters(db.select(*columns), request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        query = query.order_by(Cafe.name, Cafe.id)
+        if stream:
+            return stream_cafes(query, serializer, stream)
+        rows = db.session.execute(query)
+        return jsonify(cafes=[serializer.from_row(row) for row in rows])
 
     try:
-        decrypted_key = decrypt_key(user.api_key_enc)
-    except Exception:
-        return jsonify({"error": "API key decryption failed"}), 500
+        rows, next_cursor, limit = cafe_page(columns, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = dict(
+        cafes=[serializer.from_row(row) for row in rows],
+        limit=limit,
+        next_cursor=next_cursor,
+    )
+    if request.args.get('include_total', '').lower() == 'true':
+        response['total'] = count_cafes(request.args)
+    return jsonify(response)
+
+@api_bp.route('/cafes/search', methods=['GET'])
+@use_replica
+def search_cafes_api():
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "q parameter is required"}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        page = parse_page(request.args.get('page'), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results = search_cafes(text, limit + 1, (page - 1) * limit)
+    return jsonify(
+        cafes=[dict(cafe.to_dict(), rank=rank) for cafe, rank in results[:limit]],
+        page=page,
+        limit=limit,
+        has_more=len(results) > limit,
+    )
+
+@api_bp.route('/cafes/nearby', methods=['GET'])
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_API')
+@response_cache.cached()
+def nearby_cafes_api():
+    columns, unknown = parse_fields(request.args.get('fields'))
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {unknown}"}), 400
+    serializer = get_cafe_serializer(tuple(column.name for column in columns))
+    try:
+        lat = parse_coordinate(request.args.get('lat'), 'lat', 90)
+        lng = parse_coordinate(request.args.get('lng'), 'lng', 180)
+        radius = parse_radius(request.args.get('radius'))
+        limit = parse_limit(request.args.get('limit'))
+        results = nearby_cafes(columns, lat, lng, radius, limit, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(
+        cafes=[dict(serializer.from_row(row), distance_km=round(distance, 3)) for row, distance in results],
+        radius_km=radius,
+        limit=limit,
+    )
 
-    if api_key != decrypted_key:
+@api_bp.route('/cafes/changes', methods=['GET'])
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_API')
+@response_cache.cached()
+def cafe_changes_api():
+    columns, unknown = parse_fields(request.args.get('fields'))
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {unknown}"}), 400
+    serializer = get_cafe_serializer(tuple(column.name for column in columns))
+    try:
+        since = parse_since(request.args.get('since'))
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    changes, next_cursor, has_more = cafe_changes(columns, since, limit)
+    return jsonify(
+        changes=[
+            {"id": cafe_id, "cursor": cursor, "changed_at": changed_at, "deleted": row is None,
+             "cafe": serializer.from_row(row) if row is not None else None}
+            for cafe_id, cursor, changed_at, row in changes
+        ],
+        next_cursor=next_cursor,
+        has_more=has_more,
+    )
+
+def summary_rows(rows, key):
+    return [
+        {key: value, "cafe_count": count, "avg_coffee_price": str(Decimal(str(avg_price)).quantize(Decimal('0.01')))}
+        for value, count, avg_price in rows
+    ]
+
+def summarize_cafes_by(column, key, country=None):
+    return summary_rows(cafe_counts_by(column, country), key)
+
+@api_bp.route('/locations', methods=['GET'])
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_API')
+@response_cache.cached()
+def all_locations_api():
+    return jsonify(locations=summarize_cafes_by(Cafe.location, "location", request.args.get('country')))
+
+@api_bp.route('/countries', methods=['GET'])
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_API')
+@response_cache.cached()
+def all_countries_api():
+    return jsonify(countries=summarize_cafes_by(Cafe.country, "country"))
+
+BULK_FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'text/csv': 'csv',
+}
+
+@api_bp.route('/cafes/bulk', methods=['POST'])
+@api_key_required
+def bulk_add_cafes_api():
+    upload = request.files.get('file')
+    if upload:
+        fmt = upload.filename.rsplit('.', 1)[-1].lower() if upload.filename else ''
+        payload = upload.read()
+    else:
+        fmt = BULK_FORMATS.get(request.mimetype, '')
+        payload = request.get_data()
+    if fmt not in BULK_FORMATS.values():
+        return jsonify({"error": "Upload a JSON array, NDJSON or CSV"}), 415
+
+    try:
+        records = parse_records(payload, fmt)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Could not parse upload: {e}"}), 400
+    if not records:
+        return jsonify({"error": "No data provided"}), 400
+    if len(records) > current_app.config['BULK_IMPORT_MAX_ROWS']:
+        return jsonify({"error": f"At most {current_app.config['BULK_IMPORT_MAX_ROWS']} rows per request"}), 413
+
+    try:
+        results = import_cafes(records, g.api_user.id, current_app.config['BULK_IMPORT_CHUNK_SIZE'])
+    except IntegrityError as e:
+        db.session.rollback()
+        if not is_map_url_conflict(e):
+            raise
+        return jsonify({"error": "Cafes were added concurrently, retry the upload"}), 409
+
+    created = sum(1 for result in results if result["status"] == "created")
+    return jsonify({"created": created, "failed": len(results) - created, "results": results}), 207 if created < len(results) else 201
+
+@api_bp.route('/cafes/export', methods=['GET'])
+@use_replica
+@api_key_required
+def export_cafes_api():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {list(EXPORT_FORMATS)}"}), 400
+    try:
+        since, until = (
+            datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+            for name in ('since', 'until')
+        )
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
+
+    query = export_query(request.args.get('country'), since, until)
+    stats = ExportStats()
+    chunks = iter_export(query, fmt, current_app.config['CAFES_STREAM_BATCH_SIZE'], stats)
+    compress = request.args.get('gzip', '').lower() == 'true'
+
+    def generate():
+        yield from gzip_chunks(chunks) if compress else chunks
+        current_app.logger.info(
+            "Exported %d cafes in %.2fs (%.0f rows/sec)", stats.rows, stats.seconds, stats.rows_per_second
+        )
+
+    extension = 'csv' if fmt == 'csv' else 'jsonl'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"cafes.{extension}" + ('.gz' if compress else '')
+    response = Response(stream_with_context(generate()), mimetype='application/gzip' if compress else mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@api_bp.route('/cafes/<string:username>', methods=['POST'])
+@api_key_required
+def add_cafe_api(username):
+    data = request.get_json()
+    user = g.api_user
+    if user.username != username:
+        if not db.session.execute(db.select(User.id).filter_by(username=username)).scalar():
+            return jsonify({"error":"User does not exist"}), 404
         return jsonify({"error": "API key does not match"}), 403
 
-    map_url_check = db.session.execute(db.select(Cafe).filter_by(map_url=data['map_url'])).scalar()
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
 
     required_fields = ["can_take_calls", "coffee_price", "country", "has_sockets", "has_toilet", "has_wifi", "img_url", "location", "map_url", "name"]
     for field in required_fields:
         if field not in data:
             return jsonify({"error":f"Required field {field} not provided"}), 400
 
-    if map_url_check:
+    if map_url_owner(data['map_url']):
         return jsonify({"error":  "Cafe already exists"}), 400
 
     new_cafe = Cafe(
@@ -118,14 +334,16 @@ def add_cafe_api(username):
         user_id=user.id,
     )
     db.session.add(new_cafe)
+    db.session.flush()
+    cafe_data = new_cafe.to_dict()
     db.session.commit()
-    return jsonify({"success":"Cafe Added Successfully","cafe": new_cafe.to_dict()}), 201
+    return jsonify({"success":"Cafe Added Successfully","cafe": cafe_data}), 201
 
 
 @api_bp.route('/cafes/<int:cafe_id>', methods=['PATCH','PUT'])
+@api_key_required
 def update_cafe_api(cafe_id):
     data = request.get_json()
-    api_key = request.headers.get('X-API-KEY')
     fields = ["can_take_calls", "coffee_price", "country", "has_sockets", "has_toilet",
               "has_wifi", "img_url", "location", "map_url", "name"]
 
@@ -136,21 +354,13 @@ def update_cafe_api(cafe_id):
     if not cafe:
         return jsonify({"error": "Cafe not found"}), 404
 
-    user = db.session.execute(db.select(User).filter_by(id=cafe.user_id)).scalar()
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    try:
-        decrypted_key = decrypt_key(user.api_key_enc)
-    except Exception:
-        return jsonify({"error": "API key decryption failed"}), 500
-    if api_key != decrypted_key:
+    if cafe.user_id != g.api_user.id:
         return jsonify({"error": "API key is incorrect"}), 403
 
 
     if "map_url" in data:
-        check_map_url = db.session.execute(db.select(Cafe).filter_by(map_url=data["map_url"])).scalar()
-        if check_map_url and check_map_url.id != cafe.id:
+        owner_id = map_url_owner(data["map_url"])
+        if owner_id and owner_id != cafe.id:
             return jsonify({"error": "Map url already exists"}), 400
 
     try:
@@ -165,32 +375,21 @@ def update_cafe_api(cafe_id):
                 if field in data:
                     setattr(cafe, field, data[field])
 
+        db.session.flush()
+        cafe_data = cafe.to_dict()
         db.session.commit()
-        return jsonify({"success": "Cafe updated successfully", "cafe": cafe.to_dict()}), 200
+        return jsonify({"success": "Cafe updated successfully", "cafe": cafe_data}), 200
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
 
 @api_bp.route('/cafes/<int:cafe_id>', methods=['DELETE'])
+@api_key_required
 def delete_cafe(cafe_id):
-    api_key = request.headers.get('X-API-KEY')
-
     cafe = db.session.get(Cafe, cafe_id)
     if not cafe:
         return jsonify({"error": "Cafe not found"}), 404
 
-    user = db.session.get(User, cafe.user_id)
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    try:
-        decrypted_key = decrypt_key(user.api_key_enc)
-    except Exception:
-        return jsonify({"error": "API key decryption failed"}), 500
-
-    if not api_key:
-        return jsonify({"error": "API key not provided"}), 401
-
-    if api_key != decrypted_key:
+    if cafe.user_id != g.api_user.id:
         return jsonify({"error": "API key is incorrect"}), 403
 
     db.session.delete(cafe)
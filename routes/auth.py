@@ -0,0 +1,22 @@
+from functools import wraps
+
+from flask import request, jsonify, g
+from model import get_user_by_api_key
+
+
+def api_key_required(view):
+    """Resolve the X-API-KEY header to a User and expose it as g.api_user"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        api_key = request.headers.get('X-API-KEY')
+        if not api_key:
+            return jsonify({"error": "API key not provided"}), 401
+
+        # The rate limiter has usually resolved the key already
+        user = g.get('api_user') or get_user_by_api_key(api_key)
+        if not user:
+            return jsonify({"error": "API key is incorrect"}), 403
+
+        g.api_user = user
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,227 @@
+import base64
+import binascii
+import heapq
+import json
+import math
+from decimal import Decimal, InvalidOperation
+from operator import itemgetter
+
+from flask import current_app
+from model import db, Cafe, CafeChange
+from geo import search_cells, bounding_box, haversine_km
+
+AMENITY_FILTERS = ["has_wifi", "has_sockets", "has_toilet", "can_take_calls"]
+
+SORT_COLUMNS = {
+    'name': Cafe.name,
+    'price': Cafe.coffee_price,
+    'location': Cafe.location,
+}
+
+
+def encode_cursor(value, cafe_id):
+    return base64.urlsafe_b64encode(json.dumps([value, cafe_id], default=str).encode()).decode()
+
+def decode_cursor(cursor, sort):
+    try:
+        value, cafe_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == 'price':
+            value = Decimal(value)
+        return value, int(cafe_id)
+    except (ValueError, TypeError, binascii.Error, InvalidOperation):
+        raise ValueError("Invalid cursor")
+
+def parse_limit(value):
+    """Parse a limit= value, defaulting to and capping at the configured page sizes"""
+    if value is None:
+        return current_app.config['CAFES_PAGE_SIZE']
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, current_app.config['CAFES_MAX_PAGE_SIZE'])
+
+def parse_page(value, limit):
+    """Parse a 1-based page= value; its row offset must fit in a 64-bit integer"""
+    if value is None:
+        return 1
+    try:
+        page = int(value)
+    except ValueError:
+        raise ValueError("page must be an integer")
+    if page < 1:
+        raise ValueError("page must be positive")
+    if (page - 1) * limit >= 2 ** 63:
+        raise ValueError("page is too large")
+    return page
+
+def parse_fields(raw_fields):
+    """Split a comma separated fields= value into Cafe columns, rejecting unknown names"""
+    if not raw_fields:
+        return list(Cafe.__table__.columns), []
+    names = [name.strip() for name in raw_fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in Cafe.__table__.c]
+    return [Cafe.__table__.c[name] for name in names if name in Cafe.__table__.c], unknown
+
+def parse_bool(value):
+    value = value.lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    raise ValueError(f"Invalid boolean value: {value}")
+
+def parse_price(value, name):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"{name} must be a number")
+
+def apply_cafe_filters(query, args):
+    """Translate listing query parameters into SQL WHERE clauses"""
+    if args.get('country'):
+        query = query.where(Cafe.country == args['country'])
+    if args.get('location'):
+        query = query.where(Cafe.location == args['location'])
+    if args.get('min_price'):
+        query = query.where(Cafe.coffee_price >= parse_price(args['min_price'], 'min_price'))
+    if args.get('max_price'):
+        query = query.where(Cafe.coffee_price <= parse_price(args['max_price'], 'max_price'))
+    for amenity in AMENITY_FILTERS:
+        if args.get(amenity):
+            query = query.where(getattr(Cafe, amenity).is_(parse_bool(args[amenity])))
+    if args.get('q'):
+        pattern = f"%{args['q']}%"
+        query = query.where(db.or_(Cafe.name.ilike(pattern), Cafe.location.ilike(pattern)))
+    return query
+
+def cafe_page_query(columns, args, limit):
+    """Keyset page query for the listing parameters; fetches limit + 1 rows to detect a next page"""
+    sort = args.get('sort', 'name')
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {list(SORT_COLUMNS)}")
+    sort_column = SORT_COLUMNS[sort]
+
+    query = apply_cafe_filters(
+        db.select(*columns, sort_column.label('sort_value'), Cafe.id.label('sort_id')), args
+    )
+    query = query.order_by(sort_column, Cafe.id).limit(limit + 1)
+    if args.get('cursor'):
+        after_value, after_id = decode_cursor(args['cursor'], sort)
+        query = query.where(db.tuple_(sort_column, Cafe.id) > db.tuple_(after_value, after_id))
+    return query
+
+def split_page(rows, limit):
+    """Trim the look-ahead row and build the cursor for the next page"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][-2], rows[-1][-1])
+
+def cafe_page(columns, args):
+    """Fetch one keyset page of filtered cafes
+
+    Returns (rows, next_cursor, limit); each row holds the requested
+    columns first. Raises ValueError for invalid parameters.
+    """
+    limit = parse_limit(args.get('limit'))
+    rows = db.session.execute(cafe_page_query(columns, args, limit)).all()
+    rows, next_cursor = split_page(rows, limit)
+    return rows, next_cursor, limit
+
+def count_query(args):
+    return apply_cafe_filters(db.select(db.func.count(Cafe.id)), args)
+
+def count_cafes(args):
+    """Count cafes matching the listing filters"""
+    return db.session.execute(count_query(args)).scalar()
+
+def parse_coordinate(value, name, bound):
+    if value is None:
+        raise ValueError(f"{name} is required")
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    if not math.isfinite(number) or not -bound <= number <= bound:
+        raise ValueError(f"{name} must be between -{bound} and {bound}")
+    return number
+
+def parse_radius(value):
+    """Parse a radius= value in km, defaulting to and capping at the configured radii"""
+    if value is None:
+        return float(current_app.config['NEARBY_DEFAULT_RADIUS_KM'])
+    try:
+        radius = float(value)
+    except ValueError:
+        raise ValueError("radius must be a number")
+    if not math.isfinite(radius) or radius <= 0:
+        raise ValueError("radius must be positive")
+    return min(radius, float(current_app.config['NEARBY_MAX_RADIUS_KM']))
+
+def nearby_query(columns, lat, lng, radius_km, args):
+    """Candidates for a radius search, pruned by geohash cell and latitude band on the index"""
+    cells = search_cells(lat, lng, radius_km)
+    min_lat, max_lat = bounding_box(lat, lng, radius_km)
+    query = db.select(*columns, Cafe.latitude.label('cafe_lat'), Cafe.longitude.label('cafe_lng')).where(
+        db.or_(*(db.and_(Cafe.geohash >= cell, Cafe.geohash < cell + '~') for cell in cells)),
+        Cafe.latitude.between(min_lat, max_lat),
+    )
+    return apply_cafe_filters(query, args)
+
+def nearby_cafes(columns, lat, lng, radius_km, limit, args):
+    """Up to limit (row, distance_km) pairs within radius_km of (lat, lng), nearest first
+
+    Each row holds the requested columns followed by the cafe's latitude
+    and longitude.
+    """
+    matches = []
+    for row in db.session.execute(nearby_query(columns, lat, lng, radius_km, args)):
+        distance = haversine_km(lat, lng, row[-2], row[-1])
+        if distance <= radius_km:
+            matches.append((row, distance))
+    return heapq.nsmallest(limit, matches, key=itemgetter(1))
+
+def parse_since(value):
+    """Parse a since= change feed cursor; 0 (the default) starts from the first change"""
+    if value is None:
+        return 0
+    try:
+        since = int(value)
+    except ValueError:
+        raise ValueError("since must be a non-negative integer")
+    if since < 0:
+        raise ValueError("since must be a non-negative integer")
+    return since
+
+def cafe_changes(columns, since, limit):
+    """One page of up to limit change log entries after since
+
+    Returns (changes, next_cursor, has_more). Entries for the same cafe
+    within the page collapse into its latest one; each change is
+    (cafe_id, cursor, changed_at, row), where row holds the requested
+    columns of the cafe as it is now, or None once it has been deleted.
+    """
+    entries = db.session.execute(
+        db.select(CafeChange.id, CafeChange.cafe_id, CafeChange.changed_at)
+        .where(CafeChange.id > since).order_by(CafeChange.id).limit(limit + 1)
+    ).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for change_id, cafe_id, changed_at in entries:
+        latest.pop(cafe_id, None)
+        latest[cafe_id] = (change_id, changed_at)
+    current = {}
+    if latest:
+        rows = db.session.execute(
+            db.select(*columns, Cafe.id.label('change_cafe_id')).where(Cafe.id.in_(list(latest)))
+        )
+        current = {row[-1]: row for row in rows}
+
+    changes = [(cafe_id, change_id, changed_at, current.get(cafe_id))
+               for cafe_id, (change_id, changed_at) in latest.items()]
+    return changes, entries[-1][0] if entries else since, has_more
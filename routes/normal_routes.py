@@ -1,16 +1,33 @@
-from flask import render_template, redirect, request, flash, url_for, Blueprint
+from flask import render_template, redirect, request, flash, url_for, Blueprint, current_app
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.orm import undefer
 from werkzeug.security import generate_password_hash, check_password_hash
 from form import RegisterForm, LoginForm, CafeForm
-from model import db, User, create_and_store_api_key_for_user, decrypt_key, Cafe
+from model import db, User, decrypt_key, Cafe, cafe_counts_by, find_user_conflicts, map_url_owner
+from http_cache import cached_by_cafes_version
+from routes.listing import cafe_page, count_cafes
+from cache import response_cache
+from replica import use_replica
+from ratelimit import rate_limiter
+from jobs import job_queue
 
 normal_bp = Blueprint('normal', __name__)
 
 @normal_bp.route('/')
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_PAGES', per_user=True)
+@response_cache.cached(per_user=True)
 def home():
-    result = db.session.execute(db.select(Cafe))
-    cafes = result.scalars().all()
-    return render_template('home.html', cafes=cafes)
+    filters = request.args
+    columns = list(Cafe.__table__.columns)
+    try:
+        cafes, next_cursor, _ = cafe_page(columns, filters)
+    except ValueError:
+        filters = {}
+        cafes, next_cursor, _ = cafe_page(columns, filters)
+    countries = db.session.execute(db.select(Cafe.country).distinct().order_by(Cafe.country)).scalars().all()
+    return render_template('home.html', cafes=cafes, next_cursor=next_cursor, countries=countries,
+                           total=count_cafes(filters), filters=filters)
 
 @normal_bp.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -20,8 +37,7 @@ def add_cafe():
         fields = ["can_take_calls", "coffee_price", "country", "has_sockets", "has_toilet",
                   "has_wifi", "img_url", "location", "map_url", "name"]
         map_url = form.data.get('map_url')
-        map_check = db.session.execute(db.select(Cafe).filter_by(map_url=map_url)).scalar()
-        if map_check:
+        if map_url_owner(map_url):
             flash('Bu Kafe Zaten Mevcut',"warning")
             return redirect(url_for('normal.add_cafe'))
         try:
@@ -83,7 +99,7 @@ def update_cafe(cafe_id):
 @normal_bp.route('/delete/<int:cafe_id>', methods=['POST'])
 @login_required
 def delete_cafe(cafe_id):
-    cafe = db.session.execute(db.select(Cafe).filter_by(id=cafe_id)).scalar()
+    cafe = db.session.get(Cafe, cafe_id)
     if not cafe:
         flash('Kafe Bulunamadı','error')
         return redirect(url_for('normal.user_cafes'))
@@ -106,13 +122,22 @@ def delete_cafe(cafe_id):
 @normal_bp.route('/user/panel', methods=['GET', 'POST'])
 @login_required
 def user_panel():
-    api_key = decrypt_key(current_user.api_key_enc)
-    return render_template('user_panel.html', api_key=api_key)
+    # Newly registered users get their key from a background job
+    api_key = decrypt_key(current_user.api_key_enc) if current_user.api_key_enc else None
+    quota, route_limits = rate_limiter.usage(current_user.api_key_hash) if rate_limiter.backend else (None, {})
+    route_labels = {
+        rule.endpoint: f"{' '.join(sorted(rule.methods - {'HEAD', 'OPTIONS'}))} {rule.rule}"
+        for rule in current_app.url_map.iter_rules() if rule.endpoint in route_limits
+    }
+    return render_template('user_panel.html', api_key=api_key, quota=quota, route_limits=route_limits,
+                           route_labels=route_labels)
 
 
 @normal_bp.route('/cafe_detail/<int:cafe_id>', methods=['GET', 'POST'])
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_PAGES', per_user=True)
 def cafe_detail(cafe_id):
-    cafe = db.session.execute(db.select(Cafe).filter_by(id=cafe_id)).scalar()
+    cafe = db.session.get(Cafe, cafe_id)
     if not cafe:
         flash("Kafe bulunamadı!", "error")
         return redirect(url_for('normal.home'))
@@ -125,23 +150,12 @@ def user_cafes():
     return render_template('user_cafes.html', cafes=cafes)
 
 @normal_bp.route('/locations')
+@use_replica
+@cached_by_cafes_version('CACHE_CONTROL_PAGES', per_user=True)
+@response_cache.cached(per_user=True)
 def all_locations():
-    result = db.session.execute(db.select(Cafe))
-    cafes = result.scalars().all()
-    
-    # Tüm konumları al ve say
-    locations = {}
-    for cafe in cafes:
-        location = cafe.location
-        if location in locations:
-            locations[location] += 1
-        else:
-            locations[location] = 1
-    
-    # Konumları kafe sayısına göre sırala
-    sorted_locations = sorted(locations.items(), key=lambda x: x[1], reverse=True)
-    
-    return render_template('all_locations.html', locations=sorted_locations)
+    locations = [(location, count) for location, count, _ in cafe_counts_by(Cafe.location)]
+    return render_template('all_locations.html', locations=locations)
 
 
 @normal_bp.route('/register',methods=['GET', 'POST'])
@@ -150,13 +164,12 @@ def register():
     if form.validate_on_submit():
         email = form.email.data
         username = form.username.data
-        email_check = db.session.execute(db.Select(User).filter_by(email=email)).scalar()
-        username_check = db.session.execute(db.Select(User).filter_by(username=username)).scalar()
+        conflicts = find_user_conflicts(username, email)
 
-        if email_check:
+        if 'email' in conflicts:
             flash("Email already registered", "warning")
             return redirect(url_for('normal.register'))
-        if username_check:
+        if 'username' in conflicts:
             flash("Username already registered", "warning")
             return redirect(url_for('normal.register'))
 
@@ -169,8 +182,9 @@ def register():
             password=password_hash,
         )
         db.session.add(new_user)
+        db.session.flush()
+        job_queue.enqueue('issue_api_key', user_id=new_user.id)
         db.session.commit()
-        create_and_store_api_key_for_user(new_user)
 
         flash("Account created successfully!", "success")
         return redirect(url_for('normal.register'))
@@ -188,7 +202,7 @@ def login():
     if form.validate_on_submit():
         username = form.username.data
         password = form.password.data
-        user = User.query.filter_by(username=username).first()
+        user = User.query.filter_by(username=username).options(undefer(User.password)).first()
         if not user:
             flash("Not Found User", "warning")
             return redirect(url_for('normal.login'))
@@ -0,0 +1,85 @@
+import re
+
+from model import db, Cafe
+
+SQLITE_FTS_STATEMENTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS cafes_fts USING fts5(
+        name, location, country, content='cafes', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS cafes_fts_ai AFTER INSERT ON cafes BEGIN
+        INSERT INTO cafes_fts(rowid, name, location, country)
+        VALUES (new.id, new.name, new.location, new.country);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cafes_fts_ad AFTER DELETE ON cafes BEGIN
+        INSERT INTO cafes_fts(cafes_fts, rowid, name, location, country)
+        VALUES ('delete', old.id, old.name, old.location, old.country);
+    END""",
+    # Older databases have this trigger firing on every UPDATE (price, coordinates, ...);
+    # it is recreated so only changes to indexed columns rewrite the index
+    "DROP TRIGGER IF EXISTS cafes_fts_au",
+    """CREATE TRIGGER cafes_fts_au AFTER UPDATE OF name, location, country ON cafes BEGIN
+        INSERT INTO cafes_fts(cafes_fts, rowid, name, location, country)
+        VALUES ('delete', old.id, old.name, old.location, old.country);
+        INSERT INTO cafes_fts(rowid, name, location, country)
+        VALUES (new.id, new.name, new.location, new.country);
+    END""",
+]
+
+POSTGRES_DOCUMENT = "to_tsvector('simple', name || ' ' || location || ' ' || country)"
+
+
+def init_search():
+    """Create the full-text index for the current database dialect"""
+    dialect = db.engine.dialect.name
+    with db.engine.begin() as conn:
+        if dialect == 'sqlite':
+            exists = conn.execute(db.text(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='cafes_fts'"
+            )).scalar()
+            for statement in SQLITE_FTS_STATEMENTS:
+                conn.execute(db.text(statement))
+            if not exists:
+                conn.execute(db.text("INSERT INTO cafes_fts(cafes_fts) VALUES ('rebuild')"))
+        elif dialect == 'postgresql':
+            conn.execute(db.text(
+                f"CREATE INDEX IF NOT EXISTS ix_cafes_fts ON cafes USING GIN ({POSTGRES_DOCUMENT})"
+            ))
+
+
+def to_fts5_query(text):
+    """Quote each search term as an FTS5 prefix query so user input cannot inject syntax"""
+    terms = re.findall(r'\w+', text)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_cafes(text, limit, offset=0):
+    """Return (cafe, rank) pairs matching text, highest rank first"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        match = to_fts5_query(text)
+        if not match:
+            return []
+        ranked = db.session.execute(db.text(
+            "SELECT rowid, -bm25(cafes_fts) AS rank FROM cafes_fts WHERE cafes_fts MATCH :match "
+            "ORDER BY rank DESC, rowid LIMIT :limit OFFSET :offset"
+        ), {"match": match, "limit": limit, "offset": offset}).all()
+    elif dialect == 'postgresql':
+        ranked = db.session.execute(db.text(
+            f"SELECT id, ts_rank({POSTGRES_DOCUMENT}, plainto_tsquery('simple', :text)) AS rank "
+            f"FROM cafes WHERE {POSTGRES_DOCUMENT} @@ plainto_tsquery('simple', :text) "
+            "ORDER BY rank DESC, id LIMIT :limit OFFSET :offset"
+        ), {"text": text, "limit": limit, "offset": offset}).all()
+    else:
+        pattern = f"%{text}%"
+        ids = db.session.execute(
+            db.select(Cafe.id)
+            .where(db.or_(Cafe.name.ilike(pattern), Cafe.location.ilike(pattern), Cafe.country.ilike(pattern)))
+            .order_by(Cafe.name, Cafe.id).limit(limit).offset(offset)
+        ).scalars().all()
+        ranked = [(cafe_id, None) for cafe_id in ids]
+
+    cafes = db.session.execute(
+        db.select(Cafe).where(Cafe.id.in_([cafe_id for cafe_id, _ in ranked]))
+    ).scalars().all()
+    by_id = {cafe.id: cafe for cafe in cafes}
+    return [(by_id[cafe_id], rank) for cafe_id, rank in ranked if cafe_id in by_id]
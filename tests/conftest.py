@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+from sqlalchemy import event
+
+# config.py reads these at import time
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('FERNET_KEY', Fernet.generate_key().decode())
+
+from main import create_app, init_db
+from model import db, User, Cafe, create_and_store_api_key_for_user
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'secret123'
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        init_db()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def cafe_data(index, **values):
+    return {**dict(
+        name=f"Cafe {index}",
+        map_url=f"https://maps.google.com/?q=41.{index:04d},28.9700&test={index}",
+        img_url="https://example.com/cafe.jpg",
+        location=f"District {index % 3}",
+        country="Turkey",
+        has_toilet=True,
+        has_wifi=index % 2 == 0,
+        has_sockets=True,
+        can_take_calls=False,
+        coffee_price="2.50",
+    ), **values}
+
+
+@pytest.fixture
+def owner(app):
+    """(username, raw API key, [cafe ids]) for a user owning five cafes"""
+    with app.app_context():
+        user = User(username='owner1', email='owner@example.com', password=generate_password_hash(PASSWORD))
+        db.session.add(user)
+        db.session.flush()
+        key = create_and_store_api_key_for_user(user)
+        cafes = [Cafe(user_id=user.id, **cafe_data(index)) for index in range(5)]
+        db.session.add_all(cafes)
+        db.session.commit()
+        return user.username, key, [cafe.id for cafe in cafes]
+
+
+class QueryCounter:
+    """Records the SQL statements sent to every engine of the app"""
+
+    def __init__(self, app):
+        self.statements = []
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def run(self, call):
+        """Return (response, statements) for one request made by call(), body included"""
+        self.statements = []
+        response = call()
+        response.get_data()
+        response.close()
+        return response, self.statements
+
+
+@pytest.fixture
+def queries(app):
+    return QueryCounter(app)
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+pytest.importorskip('aiosqlite')
+pytest.importorskip('asgiref')
+
+from config import TestingConfig
+from conftest import cafe_data
+from main import create_app, init_db
+from model import db, User, Cafe
+
+
+@pytest.fixture
+def file_app(monkeypatch, tmp_path):
+    """App on a relative SQLite path, which Flask-SQLAlchemy puts under the instance folder"""
+    name = f'asgi-{tmp_path.name}.db'
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{name}')
+    app = create_app('testing')
+    with app.app_context():
+        init_db()
+        user = User(username='owner1', email='owner@example.com', password='x')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Cafe(user_id=user.id, **cafe_data(1)))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        path = os.path.join(app.instance_path, name + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def asgi_get(asgi_app, path, query=b'', headers=()):
+    """(status, body) for a GET sent straight to an ASGI app"""
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+             'client': ('127.0.0.1', 1234)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def call():
+        await asgi_app(scope, receive, send)
+        await asgi_app.engine.dispose()
+
+    asyncio.run(call())
+    return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def test_asgi_reads_the_flask_database(file_app, tmp_path):
+    from asgi import AsyncCafeAPI
+    status, body = asgi_get(AsyncCafeAPI(file_app), '/v1/cafes')
+    assert status == 200, body
+    assert [cafe['name'] for cafe in json.loads(body)['cafes']] == ['Cafe 1']
+    # No second, empty database next to the working directory
+    assert os.listdir(tmp_path) == []
+
+
+def test_asgi_rate_limits_the_forwarded_client(file_app, monkeypatch):
+    from asgi import AsyncCafeAPI
+    from ratelimit import rate_limiter
+    monkeypatch.setitem(file_app.config, 'TRUSTED_PROXY_COUNT', 1)
+    monkeypatch.setitem(rate_limiter.route_limits, 'api.all_cafes_api', (1, 60))
+    asgi_app = AsyncCafeAPI(file_app)
+    statuses = [asgi_get(asgi_app, '/v1/cafes', headers=[('X-Forwarded-For', client)])[0]
+                for client in ('203.0.113.1', '203.0.113.1', '203.0.113.2')]
+    assert statuses == [200, 429, 200]
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from conftest import cafe_data
+
+
+def listed_prices(client):
+    return {cafe['id']: cafe['coffee_price'] for cafe in client.get('/v1/cafes?fields=id,coffee_price').get_json()['cafes']}
+
+
+@pytest.mark.parametrize('price,stored', [(3.255, '3.26'), ('2.675', '2.68'), (3.265, '3.27'), (4, '4.00')])
+def test_patch_responds_with_the_stored_price(client, owner, price, stored):
+    _, key, cafe_ids = owner
+    response = client.patch(f'/v1/cafes/{cafe_ids[0]}', json={'coffee_price': price}, headers={'X-API-KEY': key})
+    assert response.status_code == 200
+    assert response.get_json()['cafe']['coffee_price'] == stored
+    assert listed_prices(client)[cafe_ids[0]] == stored
+
+
+def test_post_and_bulk_round_prices_the_same_way(client, owner):
+    username, key, _ = owner
+    response = client.post(f'/v1/cafes/{username}', json=cafe_data(50, coffee_price=3.255), headers={'X-API-KEY': key})
+    assert response.get_json()['cafe']['coffee_price'] == '3.26'
+    posted = response.get_json()['cafe']['id']
+
+    response = client.post('/v1/cafes/bulk', data=json.dumps([cafe_data(51, coffee_price='3.255')]),
+                           headers={'X-API-KEY': key, 'Content-Type': 'application/json'})
+    bulk = response.get_json()['results'][0]['id']
+    prices = listed_prices(client)
+    assert prices[posted] == prices[bulk] == '3.26'
+
+
+@pytest.mark.parametrize('page,error', [
+    ('abc', 'page must be an integer'),
+    ('1.5', 'page must be an integer'),
+    ('0', 'page must be positive'),
+    ('99999999999999999999999', 'page is too large'),
+])
+def test_search_rejects_invalid_pages(client, page, error):
+    response = client.get(f'/v1/cafes/search?q=Cafe&page={page}')
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+
+def test_search_pages(client, owner):
+    first = client.get('/v1/cafes/search?q=Cafe&limit=3').get_json()
+    second = client.get('/v1/cafes/search?q=Cafe&limit=3&page=2').get_json()
+    assert (len(first['cafes']), first['has_more'], len(second['cafes']), second['has_more']) == (3, True, 2, False)
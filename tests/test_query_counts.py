@@ -0,0 +1,81 @@
+"""SQL statements per request, so N+1 queries and extra round trips show up as failures
+
+Each case is one cold request (empty response and identity caches) against
+the owner fixture's five cafes. When a change legitimately alters a count,
+update it here and say why in the commit.
+"""
+import json
+
+import pytest
+
+from conftest import PASSWORD, cafe_data
+
+API_CASES = [
+    # (name, count, request(client, username, key, cafe_ids))
+    ('list cafes', 2, lambda c, u, k, ids: c.get('/v1/cafes')),
+    ('list cafes with total', 3, lambda c, u, k, ids: c.get('/v1/cafes?include_total=true&fields=name')),
+    ('stream cafes', 2, lambda c, u, k, ids: c.get('/v1/cafes?stream=ndjson')),
+    ('search cafes', 2, lambda c, u, k, ids: c.get('/v1/cafes/search?q=Cafe')),
+    ('nearby cafes', 2, lambda c, u, k, ids: c.get('/v1/cafes/nearby?lat=41.001&lng=28.97&radius=20')),
+    ('cafe changes', 3, lambda c, u, k, ids: c.get('/v1/cafes/changes')),
+    ('locations', 2, lambda c, u, k, ids: c.get('/v1/locations')),
+    ('countries', 2, lambda c, u, k, ids: c.get('/v1/countries')),
+    ('user info', 2, lambda c, u, k, ids: c.get(f'/v1/users/{u}/info', headers={'X-API-KEY': k})),
+    ('add user', 5, lambda c, u, k, ids: c.post('/v1/users', json={
+        'username': 'newuser1', 'email': 'new@example.com', 'password': PASSWORD})),
+    ('add cafe', 5, lambda c, u, k, ids: c.post(f'/v1/cafes/{u}', json=cafe_data(99), headers={'X-API-KEY': k})),
+    ('patch cafe', 5, lambda c, u, k, ids: c.patch(
+        f'/v1/cafes/{ids[0]}', json={'coffee_price': 3.25}, headers={'X-API-KEY': k})),
+    ('put cafe', 6, lambda c, u, k, ids: c.put(
+        f'/v1/cafes/{ids[0]}', json=cafe_data(98), headers={'X-API-KEY': k})),
+    ('delete cafe', 5, lambda c, u, k, ids: c.delete(f'/v1/cafes/{ids[0]}', headers={'X-API-KEY': k})),
+    ('bulk add cafes', 5, lambda c, u, k, ids: c.post(
+        '/v1/cafes/bulk', data=json.dumps([cafe_data(index) for index in range(100, 110)]),
+        headers={'X-API-KEY': k, 'Content-Type': 'application/json'})),
+]
+
+PAGE_CASES = [
+    ('home', 4, '/'),
+    ('locations page', 2, '/locations'),
+    ('user panel', 2, '/user/panel'),
+    ('user cafes', 1, '/user_cafes'),
+]
+
+
+@pytest.mark.parametrize('name,expected,send', API_CASES, ids=[case[0] for case in API_CASES])
+def test_api_query_count(client, owner, queries, name, expected, send):
+    response, statements = queries.run(lambda: send(client, *owner))
+    assert response.status_code < 400, response.get_data(as_text=True)
+    assert len(statements) == expected, '\n'.join(statements)
+
+
+@pytest.mark.parametrize('name,expected,path', PAGE_CASES, ids=[case[0] for case in PAGE_CASES])
+def test_page_query_count(client, owner, queries, name, expected, path):
+    client.post('/login', data={'username': owner[0], 'password': PASSWORD})
+    client.get('/user/panel')
+    response, statements = queries.run(lambda: client.get(path))
+    assert response.status_code == 200
+    assert len(statements) == expected, '\n'.join(statements)
+
+
+def test_cafe_detail_query_count(client, owner, queries):
+    response, statements = queries.run(lambda: client.get(f'/cafe_detail/{owner[2][0]}'))
+    assert response.status_code == 200
+    assert len(statements) == 2, '\n'.join(statements)
+
+
+def test_register_query_count(client, queries):
+    response, statements = queries.run(lambda: client.post('/register', data={
+        'username': 'newuser1', 'email': 'new@example.com', 'password': PASSWORD, 'two_password': PASSWORD}))
+    assert response.status_code == 302
+    # conflict check, user insert and the queued API key job, in one transaction
+    assert len(statements) == 3, '\n'.join(statements)
+
+
+def test_relationships_do_not_lazy_load(app, owner):
+    from sqlalchemy.exc import InvalidRequestError
+    from model import db, User
+    with app.app_context():
+        user = db.session.execute(db.select(User).filter_by(username=owner[0])).scalar()
+        with pytest.raises(InvalidRequestError):
+            user.cafes
@@ -0,0 +1,51 @@
+import pytest
+
+from config import TestingConfig
+from main import create_app, init_db
+from model import db
+from ratelimit import forwarded_addr
+
+# POST /v1/users allows 5 requests a minute per client
+REGISTRATION_LIMIT = 5
+
+
+def register_from(client, forwarded_for):
+    return client.post('/v1/users', json={}, headers={'X-Forwarded-For': forwarded_for},
+                       environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+
+@pytest.fixture
+def proxied_client(monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'TRUSTED_PROXY_COUNT', 1)
+    app = create_app('testing')
+    with app.app_context():
+        init_db()
+    yield app.test_client()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_clients_behind_a_trusted_proxy_get_their_own_limits(proxied_client):
+    statuses = [register_from(proxied_client, f'203.0.113.{index}').status_code
+                for index in range(REGISTRATION_LIMIT + 1)]
+    assert statuses == [400] * (REGISTRATION_LIMIT + 1)
+    statuses = [register_from(proxied_client, '198.51.100.1').status_code for _ in range(REGISTRATION_LIMIT + 1)]
+    assert statuses == [400] * REGISTRATION_LIMIT + [429]
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(client):
+    statuses = [register_from(client, f'203.0.113.{index}').status_code for index in range(REGISTRATION_LIMIT + 1)]
+    assert statuses == [400] * REGISTRATION_LIMIT + [429]
+
+
+@pytest.mark.parametrize('forwarded_for,proxies,expected', [
+    ('203.0.113.7', 1, '203.0.113.7'),
+    ('198.51.100.1, 203.0.113.7', 1, '203.0.113.7'),
+    ('198.51.100.1, 203.0.113.7', 2, '198.51.100.1'),
+    ('203.0.113.7', 2, '10.0.0.1'),
+    ('203.0.113.7', 0, '10.0.0.1'),
+    (None, 1, '10.0.0.1'),
+])
+def test_forwarded_addr_matches_proxy_fix(forwarded_for, proxies, expected):
+    assert forwarded_addr('10.0.0.1', forwarded_for, proxies) == expected
@@ -0,0 +1,34 @@
+import pytest
+
+from conftest import cafe_data
+from model import db, Cafe, ADDED_CAFE_COLUMNS, backfill_cafe_coordinates, backfill_cafe_changes
+
+
+@pytest.fixture
+def old_schema(app, owner):
+    """The owner's cafes in a cafes table from before ADDED_CAFE_COLUMNS existed"""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(db.text("DELETE FROM cafe_changes"))
+            conn.execute(db.text("DROP INDEX ix_cafes_geohash"))
+            for name in ADDED_CAFE_COLUMNS:
+                conn.execute(db.text(f"ALTER TABLE cafes DROP COLUMN {name}"))
+    return owner
+
+
+@pytest.mark.parametrize('backfills', [
+    (backfill_cafe_coordinates, backfill_cafe_changes),
+    (backfill_cafe_changes, backfill_cafe_coordinates),
+], ids=['coordinates first', 'changes first'])
+def test_backfills_upgrade_in_any_order(app, client, old_schema, backfills):
+    username, key, cafe_ids = old_schema
+    with app.app_context():
+        for backfill in backfills:
+            backfill()
+
+    response = client.post(f'/v1/cafes/{username}', json=cafe_data(99), headers={'X-API-KEY': key})
+    assert response.status_code == 201, response.get_json()
+    with app.app_context():
+        assert db.session.execute(db.select(Cafe.id).where(Cafe.updated_at.is_(None))).all() == []
+    changes = client.get('/v1/cafes/changes').get_json()['changes']
+    assert sorted({change['id'] for change in changes}) == sorted(cafe_ids + [response.get_json()['cafe']['id']])